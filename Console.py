@@ -1,21 +1,41 @@
 import Queue
+import StringIO
 import argparse
+import functools
+import hashlib
+import json
 import logging
 import os
 import random
+import shlex
 import string
 import sys
 import threading
 import time
-from argparse import ArgumentError
 from cmd import Cmd
-from threading import BoundedSemaphore
 
 from ArubaCloud.PyArubaAPI import CloudInterface
 from ArubaCloud.base.Errors import ValidationError
 from ArubaCloud.base.logsystem import ArubaLog
+from ArubaCloud.objects.VmTypes import Pro, Smart
 from termcolor import cprint
 
+from pyArubaConsole.helper.Executor import (CancelScope, QueueWorker, TimeoutError, Window, WorkerPool, as_completed,
+                                            chain, enqueue, join, wait)
+from pyArubaConsole.helper.Fleet import load_spec, plan
+from pyArubaConsole.helper.Inventory import Inventory, vm_ips
+from pyArubaConsole.helper.IpPool import IpPool
+from pyArubaConsole.helper.JobTracker import JobTracker
+from pyArubaConsole.helper.Metrics import Metrics
+from pyArubaConsole.helper.Output import RowWriter
+from pyArubaConsole.helper.Provisioning import NameRegistry, Progress, TokenBucket
+from pyArubaConsole.helper.Resilience import CircuitBreaker, call_with_retries
+from pyArubaConsole.helper.SessionCache import SessionCache
+from pyArubaConsole.helper.SingleFlight import SingleFlight
+from pyArubaConsole.helper.SshLib import ReadinessProbe, SshPool
+from pyArubaConsole.helper.TemplateCatalog import TemplateCatalog, template_to_dict
+from pyArubaConsole.helper.Watch import Watcher
+
 logger = ArubaLog(name=__name__, level=logging.INFO, log_to_file=False)
 dc_number = 6
 
@@ -26,14 +46,72 @@ creators_tq = []
 vmw_q = Queue.Queue()
 creator_q = Queue.Queue()
 
-single_lock = threading.Lock()
-vm_creation_sem = BoundedSemaphore(3)
+job_trackers = {}
 
+# per datacenter fan-out: seconds before giving up, retries of transient errors,
+# failures in a row opening the circuit and seconds it stays open
+dc_deadline = 120
+dc_retries = 2
+dc_failure_threshold = 3
+dc_cooldown = 60
+dc_breakers = {}
 
-def wait_for_all_jobs_to_finish(dc):
-    while len(pool[dc].get_jobs()['Value']) > 0:
-        time.sleep(1)
-    return True
+dc_creation_limit = 3
+dc_creation_windows = {}
+creations = set()
+api_rate = TokenBucket(5, 10)
+vm_names = NameRegistry(exists=lambda dc, name: len(inventory.by_name(name, dcs=[dc])) > 0)
+provisioning = Progress()
+
+ip_pools = {}
+ip_pool_low_water = 2
+ip_pool_batch = 5
+ip_release_at_exit = True
+
+ssh_pool = SshPool()
+ready_parallelism = 20
+readiness = None
+readiness_lock = threading.Lock()
+
+template_catalogs = {}
+
+# seconds a result of these Datacenter calls is reused, 0 only shares the calls in flight
+coalesce_ttl = {'get_vm': 0, 'get_jobs': 0, 'find_job': 0}
+
+metrics = Metrics()
+metrics.add_gauge('queue_depth', lambda: {'vmw_q': vmw_q.qsize(), 'creator_q': creator_q.qsize()})
+metrics.add_gauge('worker_busy_seconds', lambda: {'VMWorker': sum(t.busy for t in vmw_tq),
+                                                  'CreatorWorker': sum(t.busy for t in creators_tq)})
+metrics.add_gauge('worker_idle_seconds', lambda: {'VMWorker': sum(t.idle_time() for t in vmw_tq),
+                                                  'CreatorWorker': sum(t.idle_time() for t in creators_tq)})
+metrics.add_gauge('coalesced_calls', lambda: dict(
+    (name, sum(getattr(dc, name).shared + getattr(dc, name).cached for dc in pool.values()
+               if isinstance(getattr(dc, name, None), SingleFlight))) for name in coalesce_ttl))
+
+print_lock = threading.Lock()
+
+# failures reported by the command running in a thread, for script mode
+command_state = threading.local()
+
+
+def mark_failed():
+    """Record that the command running in this thread failed, even if it goes on."""
+    command_state.failed = True
+
+
+def job_tracker(dc):
+    """Return the JobTracker shared by every waiter on a datacenter."""
+    if dc not in job_trackers:
+        job_trackers.setdefault(dc, JobTracker(lambda: pool[dc].get_jobs()['Value'], logger=logger))
+    return job_trackers[dc]
+
+
+def invalidate_calls(dc, *names):
+    """Drop the results cached by the coalesced calls of a datacenter."""
+    for name in names:
+        call = getattr(pool[dc], name, None)
+        if isinstance(call, SingleFlight):
+            call.invalidate()
 
 
 def loggedin_dc():
@@ -45,133 +123,600 @@ def loggedin_dc():
     return logged_in
 
 
-def run_async_job(method=None, args=None):
+def resolve(obj, path):
+    """Return the attribute reached by following a dotted path from obj."""
+    for name in path.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def dc_breaker(dc):
+    """Return the CircuitBreaker guarding the calls to a datacenter."""
+    if dc not in dc_breakers:
+        dc_breakers.setdefault(dc, CircuitBreaker(dc_failure_threshold, dc_cooldown))
+    return dc_breakers[dc]
+
+
+def call_dc(dc, deadline, function, *args):
+    """Call function on behalf of dc, retrying transient errors until deadline, and feed its circuit breaker."""
     try:
-        for d in loggedin_dc():
-            if args is not None:
-                if isinstance(method, str):
-                    vmw_q.put([getattr(pool[d], method), args])
-                elif hasattr(method, '__call__'):
-                    vmw_q.put([method, args])
-            else:
-                if isinstance(method, str):
-                    vmw_q.put([getattr(pool[d], method)])
-                elif hasattr(method, '__call__'):
-                    vmw_q.put([method])
-        vmw_q.join()
+        result = call_with_retries(function, args, retries=dc_retries, deadline=deadline, logger=logger)
+    except IOError:
+        dc_breaker(dc).failure()
+        raise
+    dc_breaker(dc).success()
+    return result
+
+
+def iter_dcs(function, dcs, status=None):
+    """Run function(dc) for every datacenter on the VMWorker pool, yield (dc, result) as each one completes.
+
+    Datacenters failing, missing the dc_deadline or skipped by their circuit
+    breaker yield nothing, their status dict entry (when given) says why.
+    """
+    status = {} if status is None else status
+    deadline = time.time() + dc_deadline
+    futures = {}
+    for dc in dcs:
+        if dc_breaker(dc).allow() is True:
+            futures[enqueue(vmw_q, call_dc, dc, deadline, function, dc)] = dc
+        else:
+            status[dc] = 'skipped, circuit open for %ds' % dc_breaker(dc).retry_in()
+    try:
+        for future in as_completed(futures.keys(), timeout=max(0, deadline - time.time())):
+            dc = futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.debug('Call for DC: %s failed: %s' % (dc, e))
+                status[dc] = 'error: %s' % e
+                continue
+            status[dc] = 'ok'
+            yield dc, result
+    except TimeoutError:
+        for future, dc in futures.items():
+            # a call already running cannot be interrupted, its result is dropped
+            future.cancel()
+            dc_breaker(dc).failure()
+            status[dc] = 'timeout after %ss' % dc_deadline
+    finally:
+        for dc in sorted(status):
+            if status[dc] != 'ok':
+                mark_failed()
+                cprint('DC: %s: %s' % (dc, status[dc]), 'yellow', file=sys.stderr)
+
+
+def run_async_job(method=None, args=None, dcs=None, status=None):
+    """Run method once per logged in datacenter on the VMWorker pool.
+
+    method is either the dotted name of a Datacenter attribute or a callable
+    receiving the datacenter key as first argument. Returns a dict of the
+    results keyed by datacenter, holding only the datacenters that answered;
+    status (when given) is filled with the outcome of every datacenter.
+    """
+    call_args = () if args is None else (args,)
+
+    def call(dc):
+        if isinstance(method, str):
+            return resolve(pool[dc], method)(*call_args)
+        return method(dc, *call_args)
+    return dict(iter_dcs(call, dcs if dcs is not None else loggedin_dc(), status))
+
+
+def fetch_vms(dc):
+    pool[dc].get_servers()
+    return list(pool[dc].vmlist)
+
+
+inventory = Inventory(fetch_vms, spawn=lambda function, dc: enqueue(vmw_q, function, dc))
+# callers only needing a loaded inventory share one reload per datacenter
+refresh_inventory = SingleFlight(inventory.refresh)
+
+
+def add_inventory_arguments(parser):
+    parser.add_argument('--refresh', help='Reload the VM inventory before the lookup.', default=False,
+                        action='store_true')
+    parser.add_argument('--nocache', help='Query the API directly, bypassing the VM inventory.', default=False,
+                        action='store_true')
+
+
+def load_inventory(dcs, refresh=False):
+    """Load the inventory of dcs not yet known (all of them with refresh), revalidate the stale ones."""
+    missing = [dc for dc in dcs if refresh or not inventory.loaded(dc)]
+    if len(missing) > 0:
+        run_async_job(method=inventory.refresh if refresh else refresh_inventory, dcs=missing)
+    inventory.revalidate(dcs)
+
+
+def lookup_vms(dc, pattern, refresh=False, nocache=False):
+    if nocache is True:
+        return pool[dc].get_vm(pattern) or []
+    if refresh is True:
+        inventory.refresh(dc)
+    elif not inventory.loaded(dc):
+        refresh_inventory(dc)
+    return inventory.find(pattern, dcs=[dc])
+
+
+def iter_vms(pattern, dcs=None, refresh=False, nocache=False):
+    """Yield (dc, VMs whose name contains pattern) as soon as each datacenter answers."""
+    dcs = dcs if dcs is not None else loggedin_dc()
+    for dc, vms in iter_dcs(lambda dc: lookup_vms(dc, pattern, refresh, nocache), dcs):
+        yield dc, vms
+    if nocache is False:
+        inventory.revalidate(dcs)
+
+
+def find_vms(pattern, dcs=None, refresh=False, nocache=False):
+    """Return a dict of the VMs whose name contains pattern, keyed by datacenter."""
+    return dict(iter_vms(pattern, dcs, refresh, nocache))
+
+
+vm_columns = [('dc', 3), ('name', 30), ('sid', 8), ('type', 6), ('cpu', 4), ('ram', 4), ('disks', 12),
+              ('package', 10), ('template', 9), ('ip', 16), ('status', 6)]
+
+# VM fields compared by the watch command, and the mark of each kind of change
+watch_fields = ('name', 'status', 'ip', 'cpu', 'ram', 'disks', 'package')
+watch_marks = {'added': '+', 'removed': '-', 'changed': '~'}
+
+template_columns = [('id', 8), ('name', 40), ('hypervisor', 10), ('description', 0)]
+
+
+def vm_row(dc, vm):
+    row = {'dc': dc, 'name': vm.vm_name, 'sid': vm.sid, 'template': getattr(vm, 'template_id', None),
+           'ip': ','.join(vm_ips(vm)), 'status': getattr(vm, 'status', None),
+           'cpu': getattr(vm, 'cpu_qty', None), 'ram': getattr(vm, 'ram_qty', None)}
+    if isinstance(vm, Pro):
+        row.update({'type': 'pro', 'disks': '+'.join(str(h['Size']) for h in vm.hds)})
+    elif isinstance(vm, Smart):
+        row.update({'type': 'smart', 'package': vm.package})
+    return row
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--format', type=str, choices=RowWriter.formats, default='text', help='Output format.')
+    parser.add_argument('--columns', type=str, default=None, help='Comma separated columns to show.')
+    parser.add_argument('--page', type=int, default=0, help='Pause every N rows in text format.')
+
+
+def row_writer(columns, parsed):
+    """Return the RowWriter asked for by the output arguments of a command."""
+    selected = parsed.columns.split(',') if parsed.columns is not None else None
+    return RowWriter(columns, parsed.format, selected, parsed.page)
+
+
+def creation_window(dc):
+    """Return the Window bounding the VM creations in flight on a datacenter.
+
+    Creations wait in the window of their datacenter before taking a creator
+    thread, so a busy datacenter cannot hold the threads of the others.
+    """
+    if dc not in dc_creation_windows:
+        dc_creation_windows.setdefault(dc, Window(dc_creation_limit))
+    return dc_creation_windows[dc]
+
+
+def reserve_vm_name(dc, base_name, suffix):
+    """Reserve a name not used in dc, made of base_name and a random suffix if asked."""
+    for _ in xrange(10):
+        vm_name = base_name
+        if suffix is True:
+            rnd = ''.join(random.choice(string.ascii_letters) for _ in range(6))
+            vm_name = '%s-%s' % (base_name, rnd)
+        if vm_names.reserve(dc, vm_name):
+            return vm_name
+        if suffix is False:
+            break
+    raise ValidationError('Cannot find a free VM name for %s in DC: %s.' % (base_name, dc))
+
+
+def ip_pool(dc):
+    """Return the pool of public IPs bought ahead for a datacenter."""
+    if dc not in ip_pools:
+        def purchase():
+            api_rate.acquire()
+            return pool[dc].purchase_ip()
+        ip_pools.setdefault(dc, IpPool(purchase, release=lambda ip: pool[dc].remove_ip(ip.resid),
+                                       low_water=ip_pool_low_water, batch=ip_pool_batch, logger=logger))
+    return ip_pools[dc]
+
+
+def build_creator(vm_type, vm_name, params):
+    """Return the VM creator and the public IP it was given, if any."""
+    ip = None
+    if vm_type == 'smart':
+        from ArubaCloud.objects import SmartVmCreator
+        creator = SmartVmCreator(name=vm_name,
+                                 admin_password=params.admin_pwd,
+                                 template_id=params.template,
+                                 auth_obj=pool[params.dc].auth
+                                 )
+        creator.set_type(size=params.pkg)
+    else:
+        from ArubaCloud.objects import ProVmCreator
+        creator = ProVmCreator(name=vm_name,
+                               admin_password=params.adminpwd,
+                               template_id=params.template,
+                               auth_obj=pool[params.dc].auth
+                               )
+        if params.buyip is True:
+            ip = ip_pool(params.dc).get()
+            if ip is None:
+                api_rate.acquire()
+                ip = pool[params.dc].purchase_ip()
+            creator.add_public_ip(ip.resid)
+        creator.add_virtual_disk(params.disk1)
+        if params.disk2 > 0:
+            creator.add_virtual_disk(params.disk2)
+        if params.disk3 > 0:
+            creator.add_virtual_disk(params.disk3)
+        if params.disk4 > 0:
+            creator.add_virtual_disk(params.disk4)
+        creator.set_cpu_qty(int(params.cpuqty))
+        creator.set_ram_qty(int(params.ramqty))
+    return creator, ip
+
+
+def create_vm(vm_type, params):
+    """Create one VM from the parsed creator arguments, return its name."""
+    base_name = params.vmname if vm_type == 'smart' else params.name
+    vm_name = None
+    ip = None
+    committed = False
+    ok = False
+    provisioning.start()
+    try:
+        load_inventory([params.dc])
+        vm_name = reserve_vm_name(params.dc, base_name, params.number > 1)
+        creator, ip = build_creator(vm_type, vm_name, params)
+        api_rate.acquire()
+        with metrics.measure(params.dc, 'commit'):
+            committed = creator.commit(url=pool[params.dc].wcf_baseurl)
+        if committed is not True:
+            logger.warning('Cannot create VM: %s.' % vm_name)
+            return None
+        invalidate_calls(params.dc, 'get_jobs', 'find_job')
+        job_tracker(params.dc).wait(vm_name)
+        vm_names.created(params.dc, vm_name)
+        ok = True
+    finally:
+        provisioning.finish(ok)
+        if ok is False and vm_name is not None:
+            vm_names.release(params.dc, vm_name)
+        if committed is not True and ip is not None:
+            # the IP was never attached to a VM, keep it for the next creation
+            ip_pool(params.dc).put(ip)
+    cprint('Creation of VM: %s Done.' % vm_name, 'green')
+    if params.ready is True or params.bootstrap is not None or len(params.push) > 0:
+        probe_vm(params.dc, vm_name, ip, params)
+    return vm_name
+
+
+def readiness_probe():
+    """Return the ReadinessProbe shared by every creation, started on first use."""
+    global readiness
+    with readiness_lock:
+        if readiness is None:
+            readiness = ReadinessProbe(ssh_pool, ready_parallelism, logger=logger)
+    return readiness
+
+
+def vm_address(dc, vm_name, ip=None):
+    """Return the first ip address of a VM created by the console, None if it has none."""
+    if ip is not None:
+        return ip.ip_addr
+    if len(inventory.by_name(vm_name, dcs=[dc])) == 0:
+        refresh_inventory(dc)
+    for vm in inventory.by_name(vm_name, dcs=[dc]):
+        ips = vm_ips(vm)
+        if len(ips) > 0:
+            return ips[0]
+    return None
+
+
+def probe_vm(dc, vm_name, ip, params):
+    """Queue the SSH readiness probe of a new VM, then its bootstrap."""
+    since = time.time()
+    host = vm_address(dc, vm_name, ip)
+    if host is None:
+        cprint('VM: %s has no IP address, cannot probe it.' % vm_name, 'red')
+        return None
+    password = params.admin_pwd if hasattr(params, 'admin_pwd') else params.adminpwd
+    files = [tuple(f.split(':', 1)) for f in params.push]
+    future = readiness_probe().submit(host, params.ssh_user, password, since, params.bootstrap, files,
+                                      params.ready_timeout)
+    future.add_done_callback(lambda f: report_readiness(vm_name, f))
+    return future
+
+
+def report_readiness(vm_name, future):
+    if future.exception() is not None:
+        cprint('Readiness probe of VM: %s failed: %s' % (vm_name, future.exception()), 'red')
+        return
+    result = future.result()
+    if result['status'] == 'TIMEOUT':
+        cprint('VM: %s (%s) not reachable over SSH after %.0fs and %s attempts: %s' %
+               (vm_name, result['host'], result['elapsed'], result['attempts'], result['error']), 'red')
+        return
+    line = 'VM: %s (%s) ready in %.1fs after %s attempts' % (vm_name, result['host'], result['ready_after'],
+                                                             result['attempts'])
+    if 'bootstrap' in result or 'files' in result:
+        line += ', bootstrap %s in %.1fs' % ('done' if result['status'] == 'READY' else 'failed', result['elapsed'])
+    cprint(line, 'green' if result['status'] == 'READY' else 'red')
+
+
+def wait_for_provisioning():
+    """Block until every queued creation and readiness probe is done."""
+    wait(list(creations))
+    join(creator_q)
+    if readiness is not None:
+        readiness.join()
+
+
+def delete_vm_async(dc, vm):
+    """Power off one VM, watch its own job, then delete it; no thread waits while the jobs run."""
+    powered_off = enqueue(vmw_q, pool[dc].poweroff_server, None, vm.sid)
+    job_done = chain(powered_off, vmw_q, lambda _: job_tracker(dc).watch(vm.vm_name))
+    return chain(job_done, vmw_q, delete_step, dc, vm, 0)
+
+
+def delete_step(_, dc, vm, attempt):
+    try:
+        pool[dc].delete_vm(None, vm.sid)
+    except Exception:
+        # the poweroff job may not have been listed yet
+        if attempt == 2:
+            raise
+        return chain(job_tracker(dc).watch(vm.vm_name), vmw_q, delete_step, dc, vm, attempt + 1)
+    # a VM created in this session keeps its name reserved until the inventory lists it
+    vm_names.release(dc, vm.vm_name)
+    return vm.vm_name
+
+
+def report_cancelled(scope, what):
+    if scope.cancelled is True:
+        cprint('Interrupted: the %s not started yet were cancelled.' % what, 'yellow')
+
+
+def succeeded_future(future):
+    """Tell whether the future of a creation or deletion resolved with the name of its VM."""
+    return not future.cancelled() and future.exception() is None and future.result() is not None
+
+
+def report_creation(future):
+    if future.cancelled():
+        provisioning.cancel()
+    elif future.exception() is not None:
+        cprint('Creation of VM failed: %s' % future.exception(), 'red')
+
+
+def provision(vm_type, params):
+    """Queue params.number creations through the window of their datacenter, return their futures."""
+    provisioning.submit(params.number)
+    if vm_type == 'pro' and params.buyip is True:
+        ip_pool(params.dc).expect(params.number)
+    scope = CancelScope.current()
+    futures = [creation_window(params.dc).submit(enqueue, creator_q, create_vm, vm_type, params)
+               for _ in xrange(params.number)]
+    if getattr(command_state, 'creations', None) is not None:
+        command_state.creations.extend(futures)
+    for future in futures:
+        creations.add(future)
+        future.add_done_callback(creations.discard)
+        future.add_done_callback(report_creation)
+        if scope is not None:
+            scope.add(future)
+    return futures
+
+
+def vm_hosts(pattern, dc=None):
+    """Return the first ip of the VMs matching pattern, mapped to the VM name."""
+    hosts = {}
+    for vms in find_vms(pattern, dcs=[dc] if dc is not None else None).values():
+        for vm in vms:
+            ips = vm_ips(vm)
+            if len(ips) > 0:
+                hosts[ips[0]] = vm.vm_name
+    return hosts
+
+
+def print_line(line):
+    """Print a whole line at once from any thread."""
+    with print_lock:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+def fetch_templates(dc):
+    """Load every template of a datacenter with a single GetHypervisors call."""
+    dc_obj = pool[dc]
+    # get_hypervisors appends to templates, a class attribute of CloudInterface
+    dc_obj.templates = []
+    dc_obj.get_hypervisors()
+    return [template_to_dict(t) for t in dc_obj.templates]
+
+
+def template_catalog(dc):
+    """Return the template catalog of a datacenter for the logged in user."""
+    if dc not in template_catalogs:
+        user = getattr(pool[dc].auth, 'username', '')
+        key = hashlib.sha1('%s|%s' % (user, dc)).hexdigest()
+        template_catalogs.setdefault(dc, TemplateCatalog(key, lambda: fetch_templates(dc)))
+    return template_catalogs[dc]
+
+
+def check_template(dc, template_id):
+    """Tell whether template_id exists in dc, suggesting close matches when it does not."""
+    try:
+        catalog = template_catalog(dc).load()
     except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-        logger.debug('Caught Exception: %s in: %s at line: %s\nMsg: %s' % (exc_type, fname, exc_tb.tb_lineno, e))
-        raise Exception('Error in run async job')
+        logger.debug('Cannot load the template catalog of DC: %s: %s' % (dc, e))
+        cprint('Cannot check template ID: %s in DC: %s, going on: %s' % (template_id, dc, e), 'yellow')
+        return True
+    if catalog.get(template_id) is not None:
+        return True
+    print('Unknown template ID: %s in DC: %s.' % (template_id, dc))
+    similar = catalog.find(template_id)
+    if len(similar) > 0:
+        print('Did you mean: %s' % ', '.join('%(id)s (%(name)s)' % t for t in similar[:5]))
+    return False
+
+
+def check_login(dc):
+    if dc not in pool or pool[dc].is_logged_in() is not True:
+        mark_failed()
+        print('You are not logged in in DC: %s. Login before create VM.' % dc)
+        return False
     return True
 
 
-class VMWorker(threading.Thread):
+def smart_parser():
+    parser = argparse.ArgumentParser(prog='smart', add_help=True)
+    parser.add_argument('dc', type=str, help='The ID of the datacenter to create on.')
+    parser.add_argument('vmname', type=str, help='The name or the base name of the vm[s].')
+    parser.add_argument('template', type=str, help='The ID of the template that you want to deploy.')
+    parser.add_argument('admin_pwd', type=str, help='The administrator or root password for the vm.')
+    parser.add_argument('number', type=int, help='Number of VM that will be created.')
+    parser.add_argument('pkg', type=str, help='The ID for the PKG to use: small, medium, large, extralarge.')
+    add_readiness_arguments(parser)
+    return parser
+
+
+def pro_parser():
+    parser = argparse.ArgumentParser(prog='pro', add_help=True)
+    parser.add_argument('--dc', type=str, help='The ID of the datacenter to create on.', required=True)
+    parser.add_argument('--name', type=str, help='The name or the base name of the vm[s].', required=True)
+    parser.add_argument('--template', type=str, help='The ID of the template that you want to deploy.',
+                        required=True)
+    parser.add_argument('--adminpwd', type=str, help='The administrator or root password for the vm.',
+                        required=True)
+    parser.add_argument('--cpuqty', type=int, help='Amount of Cores per VM.', default=1)
+    parser.add_argument('--ramqty', type=int, help='Amount of RAM GB.', default=1)
+    parser.add_argument('--number', type=int, help='Number of VM that will be created.', required=False,
+                        default=1)
+    parser.add_argument('--disk1', type=int, help='Primary Disk Size.', default=10, required=False)
+    parser.add_argument('--disk2', type=int, help='HDD1 Disk Size.', default=0, required=False)
+    parser.add_argument('--disk3', type=int, help='HDD2 Disk Size.', default=0, required=False)
+    parser.add_argument('--disk4', type=int, help='HDD3 Disk Size.', default=0, required=False)
+    parser.add_argument('--buyip', help='Buy 1 Public IP.', default=False, required=False, action='store_true',
+                        dest='buyip')
+    add_readiness_arguments(parser)
+    return parser
+
+
+def add_readiness_arguments(parser):
+    parser.add_argument('--ready', help='Wait for the VMs to accept SSH logins after creation.', default=False,
+                        action='store_true')
+    parser.add_argument('--bootstrap', type=str, default=None,
+                        help='Command run over SSH once a VM is ready, implies --ready.')
+    parser.add_argument('--push', action='append', default=[],
+                        help='File copied once a VM is ready, as local_path:remote_path, implies --ready.')
+    parser.add_argument('--ssh-user', type=str, dest='ssh_user', default='root', help='SSH username.')
+    parser.add_argument('--ready-timeout', type=int, dest='ready_timeout', default=600,
+                        help='Seconds a VM has to become ready after its creation.')
+
+
+creator_parsers = {'smart': smart_parser, 'pro': pro_parser}
+
+
+def fleet_params(group, name):
+    """Return the creator arguments of the fleet group member called name."""
+    if group['type'] == 'smart':
+        argv = [group['dc'], name, group['template'], group['admin_pwd'], '1', group['package']]
+    else:
+        argv = ['--dc', group['dc'], '--name', name, '--template', group['template'], '--adminpwd',
+                group['admin_pwd'], '--cpuqty', str(group['cpu']), '--ramqty', str(group['ram'])]
+        for i, size in enumerate(group['disks'], 1):
+            argv.extend(['--disk%s' % i, str(size)])
+        if group['buyip'] is True:
+            argv.append('--buyip')
+    return creator_parsers[group['type']]().parse_args(argv)
+
+
+def start_workers():
+    for x in xrange(1, dc_number+1):
+        logger.debug('Starting Worker Thread: %s' % x)
+        vmw_t = VMWorker()
+        vmw_tq.append(vmw_t)
+        vmw_t.setDaemon(True)
+        vmw_t.start()
+    add_creator_workers()
+
+
+def add_creator_workers():
+    """Start creator threads until every datacenter can use its whole creation window."""
+    for cr in xrange(len(creators_tq), dc_number * dc_creation_limit):
+        logger.debug('Starting Creator Thread: %s' % cr)
+        c = CreatorWorker()
+        creators_tq.append(c)
+        c.setDaemon(True)
+        c.start()
+
+
+def stop_workers():
+    for _ in vmw_tq:
+        vmw_q.put(None)
+    for _ in creators_tq:
+        creator_q.put(None)
+    for t in vmw_tq + creators_tq:
+        t.join(5)
+    del vmw_tq[:]
+    del creators_tq[:]
+
+
+class VMWorker(QueueWorker):
 
     def __init__(self):
-        super(VMWorker, self).__init__()
-        self.stop = False
-        self.logger = logger
+        super(VMWorker, self).__init__(vmw_q, logger)
         self.logger.name = self.__class__.__name__
 
-    def run(self):
-        while self.stop is False:
-            try:
-                if not vmw_q.empty():
-                    items = vmw_q.get(True, 10)
-                    try:
-                        function = items[0]
-                        args = items[1:]
-                        if not hasattr(function, '__call__'):
-                            raise ValidationError('Function passed to thread is not a function.')
-                    except TypeError as e:
-                        self.logger.debug('Exception: %s' % e)
-                        self.logger.debug('Error retrieving queue command: %s' % items)
-                    self.logger.debug('Function: %s args: %s' % (function, args))
-                    self.logger.debug('Entering Thread VMWorker with method: %s' % function)
-                    if len(args) == 0:
-                        function()
-                    else:
-                        function(*args)
-                    self.logger.debug('Called method: %s.' % function)
-                    vmw_q.task_done()
-                time.sleep(0.25)
-            except Queue.Empty:
-                pass
-
-
-class CreatorWorker(threading.Thread):
+
+class CreatorWorker(QueueWorker):
+
     def __init__(self):
-        threading.Thread.__init__(self)
-        self.stop = False
-        self.logger = logger
+        super(CreatorWorker, self).__init__(creator_q, logger)
         self.logger.name = self.__class__.__name__
 
-    def run(self):
-        while self.stop is False:
-            try:
-                if not creator_q.empty():
-                    vm_type, params = creator_q.get(True, 10)
-                    if params.number > 1:
-                        rnd = ''.join(random.choice(string.ascii_letters) for _ in range(6))
-                        vm_name = '%s-%s' % (params.vmname, rnd)
-                    else:
-                        vm_name = params.name
-                    vm_creation_sem.acquire()
-                    # create lock to avoid double creation
-                    single_lock.acquire()
-                    op = False
-                    if vm_type is 'smart':
-                        from ArubaCloud.objects import SmartVmCreator
-                        creator = SmartVmCreator(name=vm_name,
-                                                 admin_password=params.admin_pwd,
-                                                 template_id=params.template,
-                                                 auth_obj=pool[params.dc].auth
-                                                 )
-                        creator.set_type(size=params.pkg)
-                        op = creator.commit(url=pool[params.dc].wcf_baseurl)
-                    elif vm_type is 'pro':
-                        from ArubaCloud.objects import ProVmCreator
-                        creator = ProVmCreator(name=vm_name,
-                                               admin_password=params.adminpwd,
-                                               template_id=params.template,
-                                               auth_obj=pool[params.dc].auth
-                                               )
-                        if params.buyip is True:
-                            ip = pool[params.dc].purchase_ip()
-                            creator.add_public_ip(ip.resid)
-                        creator.add_virtual_disk(params.disk1)
-                        if params.disk2 > 0:
-                            creator.add_virtual_disk(params.disk2)
-                        if params.disk3 > 0:
-                            creator.add_virtual_disk(params.disk3)
-                        if params.disk4 > 0:
-                            creator.add_virtual_disk(params.disk4)
-                        creator.set_cpu_qty(int(params.cpuqty))
-                        creator.set_ram_qty(int(params.ramqty))
-                        op = creator.commit(url=pool[params.dc].wcf_baseurl)
-                    ret = True if op is True else False
-                    single_lock.release()
-                    if ret is False:
-                        self.logger.warning('Cannot create VM.')
-                    else:
-                        while pool[params.dc].find_job(vm_name) is not 'JOBNOTFOUND':
-                            time.sleep(10)
-                        cprint('Creation of VM: %s Done.' % vm_name, 'green')
-                    creator_q.task_done()
-                    vm_creation_sem.release()
-                time.sleep(0.25)
-            except Queue.Empty:
-                pass
-
 
 class Datacenter(CloudInterface):
 
+    instrumented = ('login', 'get_servers', 'get_ip', 'get_vm', 'get_jobs', 'find_job', 'get_hypervisors',
+                    'find_template', 'poweroff_server', 'poweron_server', 'delete_vm', 'purchase_ip', 'remove_ip')
+
+    # resource families loaded on first access, with the method loading them
+    lazy_resources = {'vmlist': 'get_servers', 'iplist': 'get_ip'}
+
+    # calls changing what the coalesced calls return
+    invalidates = {'get_servers': ('get_vm',), 'poweroff_server': ('get_jobs', 'find_job'),
+                   'poweron_server': ('get_jobs', 'find_job'), 'delete_vm': ('get_jobs', 'find_job')}
+
     def __init__(self, dc):
+        self._resources = {}
+        self._loaded = set()
+        self._loading = set()
+        self._load_lock = threading.RLock()
         super(Datacenter, self).__init__(dc)
         self._dc = dc
         self._loggedin = False
+        self.session_restored = False
+        for name in self.instrumented:
+            if hasattr(self, name):
+                setattr(self, name, metrics.timed(dc, name, getattr(self, name)))
+        for name, ttl in coalesce_ttl.items():
+            if hasattr(self, name):
+                setattr(self, name, SingleFlight(getattr(self, name), ttl))
+        for name, stale in self.invalidates.items():
+            if hasattr(self, name):
+                setattr(self, name, self._invalidating(getattr(self, name), stale))
+
+    def _invalidating(self, function, names):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            finally:
+                invalidate_calls(self.dc, *names)
+        return wrapper
 
     @property
     def dc(self):
@@ -181,13 +726,70 @@ class Datacenter(CloudInterface):
     def dc(self, value):
         self._dc = str(value)
 
-    def login(self, username, password, load=True):
-        super(Datacenter, self).login(username, password, load)
+    def login(self, username, password, load=True, cache=None):
+        """Login, reusing a valid session from cache (a SessionCache) if given."""
+        self.session_restored = False
+        if cache is not None:
+            # the auth object is built locally, no API call is made without load
+            super(Datacenter, self).login(username, password, load=False)
+            try:
+                self.session_restored = cache.restore(self, username, password, self.dc)
+            except Exception as e:
+                self.logger.debug('Cannot restore cached session for DC: %s: %s' % (self.dc, e))
+        if self.session_restored is False:
+            super(Datacenter, self).login(username, password, load)
+            if cache is not None and load is True:
+                try:
+                    cache.store(self, username, password, self.dc)
+                except Exception as e:
+                    self.logger.debug('Cannot cache session for DC: %s: %s' % (self.dc, e))
         self._loggedin = True
 
     def is_logged_in(self):
         return self._loggedin
 
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def _lazy(self, name):
+        # the loader assigns the resource before filling it, other readers wait until it returned
+        if name not in self._loaded:
+            with self._load_lock:
+                if name not in self._loaded and name not in self._loading:
+                    self._loading.add(name)
+                    try:
+                        getattr(self, self.lazy_resources[name])()
+                    finally:
+                        self._loading.discard(name)
+                    self._loaded.add(name)
+        return self._resources[name]
+
+    def _store(self, name, value):
+        self._resources[name] = value
+        if name not in self._loading:
+            # set by an eager login or a restored session
+            self._loaded.add(name)
+
+    @property
+    def vmlist(self):
+        return self._lazy('vmlist')
+
+    @vmlist.setter
+    def vmlist(self, value):
+        self._store('vmlist', value)
+
+    @property
+    def iplist(self):
+        return self._lazy('iplist')
+
+    @iplist.setter
+    def iplist(self, value):
+        self._store('iplist', value)
+
+    def get_vm(self, pattern=None):
+        self._lazy('vmlist')
+        return super(Datacenter, self).get_vm(pattern)
+
 
 # noinspection PyBroadException
 class Creator(Cmd, object):
@@ -197,63 +799,211 @@ class Creator(Cmd, object):
         self.prompt = '#(creator)> '
         self.logger = logger
 
+    def postcmd(self, stop, line):
+        # commands return -1 on errors, only exit leaves the loop
+        return stop is True
+
     @staticmethod
     def do_smart(args):
         """Create Smart Server, (use smart -h to obtain help)"""
-        smart_parser = argparse.ArgumentParser(prog='smart', add_help=True)
-        smart_parser.add_argument('dc', type=str, help='The ID of the datacenter to create on.')
-        smart_parser.add_argument('vmname', type=str, help='The name or the base name of the vm[s].')
-        smart_parser.add_argument('template', type=str, help='The ID of the template that you want to deploy.')
-        smart_parser.add_argument('admin_pwd', type=str, help='The administrator or root password for the vm.')
-        smart_parser.add_argument('number', type=int, help='Number of VM that will be created.')
-        smart_parser.add_argument('pkg', type=str, help='The ID for the PKG to use: small, medium, large, extralarge.')
         try:
-            parsed = smart_parser.parse_args(args.split())
+            parsed = smart_parser().parse_args(shlex.split(args))
         except:
-            return
+            return -1
         print('Creating Smart Server... Wait until the creation is done.')
         print('The process could take some minutes (up to 15), please be patience.')
-        if parsed.dc in pool.keys():
-            if pool[parsed.dc].is_logged_in() is not True:
-                print('You are not logged in in DC: %s. Login before create VM.' % parsed.dc)
-                return -1
-            setattr(parsed, 'auth', pool[parsed.dc].auth)
-            for i in xrange(parsed.number):
-                creator_q.put(('smart', parsed))
-        else:
-            print("You are not logged in in DC: %s. Login before create VM.' % parsed.dc")
+        if check_login(parsed.dc) is not True or check_template(parsed.dc, parsed.template) is not True:
             return -1
+        provision('smart', parsed)
 
     @staticmethod
     def do_pro(args):
         """Create Pro Server, (user pro -h to obtain help)"""
-        pro_parser = argparse.ArgumentParser(prog='pro', add_help=True)
-        pro_parser.add_argument('--dc', type=str, help='The ID of the datacenter to create on.', required=True)
-        pro_parser.add_argument('--name', type=str, help='The name or the base name of the vm[s].', required=True)
-        pro_parser.add_argument('--template', type=str, help='The ID of the template that you want to deploy.',
-                                required=True)
-        pro_parser.add_argument('--adminpwd', type=str, help='The administrator or root password for the vm.',
-                                required=True)
-        pro_parser.add_argument('--cpuqty', type=int, help='Amount of Cores per VM.', default=1)
-        pro_parser.add_argument('--ramqty', type=int, help='Amount of RAM GB.', default=1)
-        pro_parser.add_argument('--number', type=int, help='Number of VM that will be created.', required=False,
-                                default=1)
-        pro_parser.add_argument('--disk1', type=int, help='Primary Disk Size.', default=10, required=False)
-        pro_parser.add_argument('--disk2', type=int, help='HDD1 Disk Size.', default=0, required=False)
-        pro_parser.add_argument('--disk3', type=int, help='HDD2 Disk Size.', default=0, required=False)
-        pro_parser.add_argument('--disk4', type=int, help='HDD3 Disk Size.', default=0, required=False)
-        pro_parser.add_argument('--buyip', help='Buy 1 Public IP.', default=False, required=False, action='store_true',
-                                dest='buyip')
         try:
-            parsed = pro_parser.parse_args(args.split())
+            parsed = pro_parser().parse_args(shlex.split(args))
         except:
-            return
+            return -1
         print('Enqueuing Pro Server VM creation.')
-        if pool[parsed.dc].is_logged_in() is not True:
-            print('You are not logged in in DC: %s. Login before create VM.' % parsed.dc)
-            return None
-        for i in xrange(parsed.number):
-            creator_q.put(('pro', parsed))
+        if check_login(parsed.dc) is not True or check_template(parsed.dc, parsed.template) is not True:
+            return -1
+        provision('pro', parsed)
+
+    @staticmethod
+    def do_batch(args):
+        """Create the VMs listed in a spec file, one smart or pro command per line. See batch -h for help."""
+        parser = argparse.ArgumentParser(prog='batch', add_help=True)
+        parser.add_argument('spec', type=str, help='File with one "smart ..." or "pro ..." line per VM group.')
+        parser.add_argument('--wait', help='Wait for every creation and print a summary.', default=False,
+                            action='store_true')
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        requests = []
+        with open(p.spec) as spec:
+            for lineno, line in enumerate(spec, 1):
+                line = line.strip()
+                if line == '' or line.startswith('#'):
+                    continue
+                vm_type, _, line_args = line.partition(' ')
+                try:
+                    parsed = creator_parsers[vm_type]().parse_args(shlex.split(line_args))
+                except (KeyError, SystemExit):
+                    print('Invalid line %s in %s: %s' % (lineno, p.spec, line))
+                    return -1
+                if check_login(parsed.dc) is not True or check_template(parsed.dc, parsed.template) is not True:
+                    return -1
+                requests.append((vm_type, parsed))
+        with CancelScope() as scope:
+            futures = []
+            for vm_type, parsed in requests:
+                futures.extend(provision(vm_type, parsed))
+            print('Enqueued %s VM creations.' % len(futures))
+            if p.wait is True:
+                wait(futures)
+                wait_for_provisioning()
+        report_cancelled(scope, 'creations')
+        if p.wait is True:
+            print(provisioning.summary())
+            if readiness is not None:
+                print(readiness.summary())
+
+    @staticmethod
+    def do_ippool(args):
+        """Show or tune the public IPs bought ahead for pro --buyip. See ippool -h for help."""
+        global ip_pool_low_water, ip_pool_batch, ip_release_at_exit
+        parser = argparse.ArgumentParser(prog='ippool', add_help=True)
+        parser.add_argument('--dc', type=str, help='Buy IPs ahead for this datacenter.', default=None)
+        parser.add_argument('--fill', type=int, help='Number of IPs to buy ahead on --dc.', default=0)
+        parser.add_argument('--low-water', type=int, dest='low_water', default=None,
+                            help='Buy more IPs when the stock of a datacenter drops below this.')
+        parser.add_argument('--batch', type=int, help='IPs bought at once when refilling.', default=None)
+        parser.add_argument('--release-at-exit', dest='release', action='store_true', default=None,
+                            help='Release unused IPs when the console exits.')
+        parser.add_argument('--keep-at-exit', dest='release', action='store_false',
+                            help='Only report unused IPs when the console exits.')
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        if p.low_water is not None:
+            ip_pool_low_water = p.low_water
+        if p.batch is not None:
+            ip_pool_batch = p.batch
+        for dc_pool in ip_pools.values():
+            dc_pool.low_water = ip_pool_low_water
+            dc_pool.batch = ip_pool_batch
+        if p.release is not None:
+            ip_release_at_exit = p.release
+        if p.dc is not None and p.fill > 0:
+            if check_login(p.dc) is not True:
+                return -1
+            ip_pool(p.dc).expect(p.fill)
+        for dc in sorted(ip_pools):
+            print('Datacenter: %s IPs ready: %s expected: %s' % (dc, len(ip_pools[dc]), ip_pools[dc].expected))
+        print('Low water: %s batch: %s unused IPs at exit: %s' %
+              (ip_pool_low_water, ip_pool_batch, 'released' if ip_release_at_exit else 'kept'))
+
+    @staticmethod
+    def do_progress(args):
+        """Show the progress of the VM creations."""
+        print(provisioning.summary())
+        if readiness is not None:
+            print(readiness.summary())
+
+    @staticmethod
+    def do_apply(args):
+        """Create and delete VMs until the datacenters match a YAML or JSON fleet spec. See apply -h for help."""
+        parser = argparse.ArgumentParser(prog='apply', add_help=True)
+        parser.add_argument('spec', type=str, help='Fleet spec file, .yaml/.yml (needs PyYAML) or JSON.')
+        parser.add_argument('--dry-run', dest='dry_run', help='Only print the changes.', default=False,
+                            action='store_true')
+        parser.add_argument('--yes', help='Confirm the deletions, nothing is applied without it when VMs would '
+                                          'be deleted.', default=False, action='store_true')
+        parser.add_argument('--parallel', type=int, default=dc_creation_limit,
+                            help='Changes in flight per datacenter.')
+        try:
+            p = parser.parse_args(shlex.split(args))
+        except:
+            return -1
+        try:
+            groups = load_spec(p.spec)
+        except (IOError, ValueError) as e:
+            print('Invalid fleet spec: %s' % e)
+            return -1
+        dcs = sorted(set(group['dc'] for group in groups))
+        for dc in dcs:
+            if check_login(dc) is not True:
+                return -1
+        status = {}
+        run_async_job(method=inventory.refresh, dcs=dcs, status=status)
+        if any(state != 'ok' for state in status.values()):
+            print('Cannot list the VMs of every datacenter, nothing applied.')
+            return -1
+        creates, deletes, drifts = plan(groups, lambda dc: [vm_row(dc, vm) for vm in inventory.vms(dc)])
+        for group, name in creates:
+            print('+ DC: %s %s (%s, template %s)' % (group['dc'], name, group['type'], group['template']))
+        for group, row in deletes:
+            print('- DC: %s %s (sid: %s)' % (group['dc'], row['name'], row['sid']))
+        for group, row, fields in drifts:
+            print('! DC: %s %s differs from its group, not changed: %s' % (
+                group['dc'], row['name'], ', '.join('%s: %s -> %s' % (field, current, desired)
+                                                    for field, (current, desired) in sorted(fields.items()))))
+        if len(creates) == 0 and len(deletes) == 0:
+            print('Fleet is up to date.')
+            return
+        if p.dry_run is True:
+            print('%s VM(s) to create, %s to delete.' % (len(creates), len(deletes)))
+            return
+        if len(deletes) > 0 and p.yes is not True:
+            print('%s VM(s) would be deleted, nothing applied: rerun with --yes to confirm.' % len(deletes))
+            return -1
+        for dc, template in sorted(set((group['dc'], group['template']) for group, _ in creates)):
+            if check_template(dc, template) is not True:
+                return -1
+        def create(group, name):
+            return provision(group['type'], fleet_params(group, name))[0]
+
+        def delete(group, row):
+            return delete_vm_async(group['dc'], inventory.by_sid(row['sid'], dcs=[group['dc']])[0])
+
+        windows = dict((dc, Window(p.parallel)) for dc in dcs)
+        with CancelScope() as scope:
+            created = [scope.add(windows[group['dc']].submit(create, group, name)) for group, name in creates]
+            deleted = [scope.add(windows[group['dc']].submit(delete, group, row)) for group, row in deletes]
+            wait(created + deleted)
+        report_cancelled(scope, 'fleet changes')
+        succeeded = [len([f for f in futures if succeeded_future(f)]) for futures in (created, deleted)]
+        print('Created: %s/%s deleted: %s/%s' % (succeeded[0], len(created), succeeded[1], len(deleted)))
+        if len(deleted) > 0:
+            run_async_job(method=inventory.refresh, dcs=dcs)
+        if succeeded != [len(created), len(deleted)]:
+            return -1
+
+    @staticmethod
+    def do_limits(args):
+        """Show or set the creation limits. See limits -h for help."""
+        global dc_creation_limit
+        parser = argparse.ArgumentParser(prog='limits', add_help=True)
+        parser.add_argument('--dc-concurrency', type=int, dest='dc_concurrency', default=None,
+                            help='VM creations in flight per datacenter.')
+        parser.add_argument('--rate', type=float, default=None, help='API calls per second, 0 for no limit.')
+        parser.add_argument('--burst', type=int, default=None, help='API calls allowed in a burst.')
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        if p.dc_concurrency is not None:
+            dc_creation_limit = max(1, p.dc_concurrency)
+            add_creator_workers()
+            for window in dc_creation_windows.values():
+                window.resize(dc_creation_limit)
+        if p.rate is not None:
+            api_rate.rate = p.rate
+        if p.burst is not None:
+            api_rate.burst = p.burst
+        print('Creations per DC: %s (creator threads: %s) API rate: %s/s burst: %s' %
+              (dc_creation_limit, len(creators_tq), api_rate.rate, api_rate.burst))
 
     def do_exit(self, args):
         """Exits from the console"""
@@ -269,6 +1019,10 @@ class IConsole(Cmd, object):
         self.intro = "Wellcome to Aruba Cloud Python Console"
         self.logger = logger
 
+    def postcmd(self, stop, line):
+        # commands return -1 on errors, only exit leaves the loop
+        return stop is True
+
     def do_exit(self, args):
         """Exits from the console"""
         return True
@@ -285,25 +1039,50 @@ class IConsole(Cmd, object):
         parser.add_argument('--dc', help='Datacenter to login into.', required=True)
         parser.add_argument('--username', help='Username', required=True)
         parser.add_argument('--password', help='Password', required=True)
+        parser.add_argument('--eager', help='Load servers and IPs at login instead of on first use.',
+                            default=False, action='store_true')
+        parser.add_argument('--cache', help='Reuse and store login sessions on disk, implies --eager.',
+                            default=False, action='store_true')
+        parser.add_argument('--cache-ttl', type=int, help='Seconds a cached session stays valid.', default=3600,
+                            dest='cache_ttl')
         try:
             p = parser.parse_args(args.split())
         except:
-            return
+            return -1
+        cache = SessionCache(ttl=p.cache_ttl) if p.cache is True else None
+        futures = {}
         try:
             if 'all' in p.dc.lower():
                 cprint('Logging in ALL Datacenter!!! WARNING!!!', 'red')
-                for _x in xrange(1, 6+1):
-                    pool[_x] = Datacenter(str(_x))
-                    pool[_x].login(p.username, p.password)
+                dcs = [str(_x) for _x in xrange(1, dc_number+1)]
             else:
-                pool[p.dc] = Datacenter(p.dc)
-                pool[p.dc].login(p.username, p.password)
+                dcs = [p.dc]
+            for dc in dcs:
+                pool[dc] = Datacenter(dc)
+                futures[dc] = enqueue(vmw_q, pool[dc].login, p.username, p.password,
+                                      load=p.eager or p.cache, cache=cache)
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             self.logger.debug('Caught Exception: %s in: %s at line: %s\nMsg: %s' %
                               (exc_type, fname, exc_tb.tb_lineno, e))
             self.logger.critical('Error instancing Datacenter Class:\n %s' % e)
+            mark_failed()
+        for dc in sorted(futures):
+            inventory.drop(dc)
+            template_catalogs.pop(dc, None)
+            dc_breakers.pop(dc, None)
+            try:
+                futures[dc].result()
+            except Exception as e:
+                self.logger.debug('Login in DC: %s failed: %s' % (dc, e))
+                cprint('DC %s: login failed (%s)' % (dc, e), 'red')
+                mark_failed()
+                continue
+            # a restored session may be up to its ttl old, the inventory reloads from the API instead
+            if pool[dc].is_loaded('vmlist') and pool[dc].session_restored is not True:
+                inventory.update(dc, list(pool[dc].vmlist))
+            cprint('DC %s: %s' % (dc, 'session restored' if pool[dc].session_restored else 'logged in'), 'green')
 
     @staticmethod
     def do_showvm(args):
@@ -311,38 +1090,22 @@ class IConsole(Cmd, object):
         parser = argparse.ArgumentParser(prog='showvm', add_help=True)
         parser.add_argument('--dc', type=str, help='ID of the datacenter.', required=False, default=None)
         parser.add_argument('--name', type=str, help='Pattern String to find.', required=False)
+        add_inventory_arguments(parser)
+        add_output_arguments(parser)
         try:
             p = parser.parse_args(args.split())
         except:
-            return
+            return -1
         dc_list = [p.dc] if p.dc is not None else loggedin_dc()
-        for dc in dc_list:
-            print("Datacenter: {}".format(dc))
-            for vm in pool[dc].get_vm(pattern=p.name):
-                try:
-                    from ArubaCloud.objects.VmTypes import Pro, Smart
-                    if isinstance(vm, Pro):
-                        hds = [
-                            ('Size: {} GB'.format(h['Size']), 'ResourceId: {}'.format(h['ResourceId']))
-                            for h in vm.hds
-                            ]
-                        print('VM {} (cores: {}, memory: {} GB, disks: {})\n-> ServerId: {}\n-> TemplateId: {}'.format(
-                            vm.vm_name,
-                            vm.cpu_qty,
-                            vm.ram_qty,
-                            hds,
-                            vm.sid,
-                            vm.template_id
-                        ))
-                    if isinstance(vm, Smart):
-                        print('VM {} (Pkg: {})\n-> ServerId: {}\n->TemplateId: {}'.format(
-                            vm.vm_name,
-                            vm.package,
-                            vm.sid,
-                            vm.template_id
-                        ))
-                except AttributeError:
-                    pass
+        try:
+            writer = row_writer(vm_columns, p)
+        except ValueError as e:
+            print(e)
+            return -1
+        for dc, vms in iter_vms(p.name, dcs=dc_list, refresh=p.refresh, nocache=p.nocache):
+            for vm in vms:
+                if writer.write(vm_row(dc, vm)) is False:
+                    return
 
     @staticmethod
     def do_findip(args=None):
@@ -351,26 +1114,33 @@ class IConsole(Cmd, object):
         In this case the program will search only in the specified one.
         """
         parser = argparse.ArgumentParser(prog='findip', add_help=True)
-        parser.add_argument('dc', type=str, help='ID of the datacenter.')
+        parser.add_argument('dc', type=str, help='ID of the datacenter, or all.')
         parser.add_argument('ip', type=str, help='The ip address to search for.')
+        add_inventory_arguments(parser)
+        add_output_arguments(parser)
         try:
             parsed = parser.parse_args(args.split())
-        except ArgumentError:
-            return 0
-        if isinstance(parsed.dc, str):
-            vm = pool[parsed.dc].vmlist.find_ip(parsed.ip)
-            if vm is None:
-                print('No VM found with IP: %s' % parsed.ip)
-            else:
-                print(vm)
-        else:
-            run_async_job(method='vmlist.find_ip', args=parsed.ip)
-            for dc in loggedin_dc():
-                for vm in pool[dc].vmlist.last_search_result:
-                    if vm[0] is None:
-                        print('No VM found in DC: %s, with IP: %s' % (parsed.dc, parsed.ip))
-                    else:
-                        print(vm[0])
+        except:
+            return -1
+        dcs = loggedin_dc() if parsed.dc.lower() == 'all' else [parsed.dc]
+        try:
+            writer = row_writer(vm_columns, parsed)
+        except ValueError as e:
+            print(e)
+            return -1
+
+        def lookup(dc):
+            if parsed.nocache is True:
+                return pool[dc].vmlist.find_ip(parsed.ip)
+            if parsed.refresh is True or not inventory.loaded(dc):
+                inventory.refresh(dc)
+            return (inventory.by_ip(parsed.ip, dcs=[dc]) or [None])[0]
+
+        for dc, vm in iter_dcs(lookup, dcs):
+            if vm is not None and writer.write(vm_row(dc, vm)) is False:
+                return
+        if writer.rows == 0 and parsed.format == 'text':
+            print('No VM found with IP: %s' % parsed.ip)
 
     @staticmethod
     def do_findtemplate(args):
@@ -381,15 +1151,36 @@ class IConsole(Cmd, object):
         parser.add_argument('--template', type=str, help='Name of the template to find', required=True)
         parser.add_argument('--datacenter', type=str, help='Datacenter where to search', required=True)
         parser.add_argument('--hypervisor', type=int, help='Hypervisor ID', required=False, default=None)
+        parser.add_argument('--refresh', help='Reload the template catalog before the lookup.', default=False,
+                            action='store_true')
+        parser.add_argument('--nocache', help='Query the API directly, bypassing the template catalog.',
+                            default=False, action='store_true')
+        add_output_arguments(parser)
         try:
             parsed = parser.parse_args(args.split())
         except:
-            return
+            return -1
+        try:
+            writer = row_writer(template_columns, parsed)
+        except ValueError as e:
+            print(e)
+            return -1
+        if check_login(parsed.datacenter) is not True:
+            return -1
         dc_obj = pool[parsed.datacenter]
-        templates = dc_obj.find_template(name=parsed.template, hv=parsed.hypervisor)
-        for template in templates:
-            print template
-        return
+        try:
+            if parsed.nocache is True:
+                templates = dc_obj.find_template(name=parsed.template, hv=parsed.hypervisor)
+                writer.write_all(template_to_dict(template) for template in templates)
+                return
+            hypervisor = parsed.hypervisor
+            if hypervisor is not None and isinstance(getattr(dc_obj, 'hypervisors', None), dict):
+                hypervisor = dc_obj.hypervisors.get(hypervisor, hypervisor)
+            catalog = template_catalog(parsed.datacenter).load(parsed.refresh)
+            writer.write_all(catalog.find(parsed.template, hypervisor))
+        except Exception as e:
+            cprint('Cannot search the templates of DC: %s: %s' % (parsed.datacenter, e), 'red')
+            return -1
 
     @staticmethod
     def do_poweroff(args=None):
@@ -397,44 +1188,32 @@ class IConsole(Cmd, object):
         parser = argparse.ArgumentParser(prog='poweroff', add_help=True)
         parser.add_argument('--dc', type=str, help='ID of the datacenter.', required=True)
         parser.add_argument('--name', type=str, help='The name of the vm(s) to be powered off.', required=True)
+        add_inventory_arguments(parser)
         try:
             parsed = parser.parse_args(args.split())
         except:
-            return
-        if isinstance(parsed.dc, str):
-            run_async_job(method='get_vm', args=parsed.name)
-            for vm in pool[parsed.dc].vmlist.last_search_result:
-                vmw_q.put([vm.poweroff])
-            vmw_q.join()
-        else:
-            run_async_job(method='get_vm', args=parsed.name)
-            for dc in loggedin_dc():
-                for vm in pool[dc].vmlist.last_search_result:
-                    vmw_q.put([vm.poweroff])
-            vmw_q.join()
+            return -1
+        results = find_vms(parsed.name, dcs=[parsed.dc], refresh=parsed.refresh, nocache=parsed.nocache)
+        with CancelScope() as scope:
+            wait([enqueue(vmw_q, vm.poweroff) for vms in results.values() for vm in vms])
+        report_cancelled(scope, 'poweroffs')
 
     @staticmethod
     def do_poweron(args=None):
         """Poweron a VM. See poweron -h for help."""
         parser = argparse.ArgumentParser(prog='poweron', add_help=True)
         parser.add_argument('--dc', type=str, help='ID of the datacenter.')
-        parser.add_argument('--name', type=str, help='The name of the vm(s) to be powered off.')
+        parser.add_argument('--name', type=str, help='The name of the vm(s) to be powered on.', required=True)
+        add_inventory_arguments(parser)
         try:
             parsed = parser.parse_args(args.split())
         except:
-            return
-        if isinstance(parsed.dc, str):
-            run_async_job(method='get_vm', args=parsed.name)
-            for _ in loggedin_dc():
-                for vm in pool[parsed.dc].vmlist.last_search_result:
-                    vmw_q.put([vm.poweron])
-                vmw_q.join()
-        else:
-            run_async_job(method='get_vm', args=parsed.vmname)
-            for dc in loggedin_dc():
-                for vm in pool[dc].vmlist.last_search_result:
-                    vmw_q.put([vm.poweron])
-            vmw_q.join()
+            return -1
+        dcs = [parsed.dc] if isinstance(parsed.dc, str) else None
+        results = find_vms(parsed.name, dcs=dcs, refresh=parsed.refresh, nocache=parsed.nocache)
+        with CancelScope() as scope:
+            wait([enqueue(vmw_q, vm.poweron) for vms in results.values() for vm in vms])
+        report_cancelled(scope, 'poweron calls')
 
     @staticmethod
     def do_deletevm(args):
@@ -446,27 +1225,304 @@ class IConsole(Cmd, object):
                                  'WARNING: If you have two or more VM named for example: testvm, testvm2, testvm3 and'
                                  'you do:'
                                  'deletevm --dc 2 --name testvm, ALL OF THE MACHINE NAMED TESTVM* WILL BE POWERED OFF'
-                                 'AND DELETED!!!!'
+                                 'AND DELETED!!!!',
+                            required=True
                             )
+        parser.add_argument('--parallel', type=int, help='VMs deleted at the same time per datacenter.', default=5)
+        add_inventory_arguments(parser)
         try:
             p = parser.parse_args(args.split())
         except:
-            return
-        run_async_job(method='get_vm', args=p.name)
-        cprint('Powering off VM...', 'yellow')
-        for dc in loggedin_dc():
-            for vm in pool[dc].vmlist.last_search_result:
-                vmw_q.put([pool[dc].poweroff_server, None, vm.sid])
-        vmw_q.join()
-        cprint('Waiting for VM(s) to poweroff...', 'yellow')
-        run_async_job(method=wait_for_all_jobs_to_finish, args=p.dc)
-        cprint('Deleting VM...', 'red')
-        for dc in loggedin_dc():
-            for vm in pool[dc].vmlist.last_search_result:
-                vmw_q.put([pool[dc].delete_vm, None, vm.sid])
-        vmw_q.join()
+            return -1
+        dcs = [p.dc] if p.dc is not None else None
+        results = find_vms(p.name, dcs=dcs, refresh=p.refresh, nocache=p.nocache)
+        targets = [(dc, vm) for dc, vms in sorted(results.items()) for vm in vms]
+        deletion = Progress()
+        deletion.submit(len(targets))
+        windows = dict((dc, Window(p.parallel)) for dc in results)
+
+        def start(dc, vm):
+            deletion.start()
+            future = delete_vm_async(dc, vm)
+            future.add_done_callback(lambda f: deletion.finish(None if f.cancelled() else f.exception() is None))
+            return future
+
+        def report(future, dc, vm):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                print_line('Deletion of VM: %s failed: %s' % (vm.vm_name, future.exception()))
+            else:
+                print_line('Deleted VM: %s (%s/%s)' % (vm.vm_name, deletion.done + deletion.failed, len(targets)))
+
+        cprint('Deleting %s VM(s): poweroff, wait, delete...' % len(targets), 'red')
+        with CancelScope() as scope:
+            futures = []
+            for dc, vm in targets:
+                future = scope.add(windows[dc].submit(start, dc, vm))
+                future.add_done_callback(lambda f, dc=dc, vm=vm: report(f, dc, vm))
+                futures.append(future)
+            wait(futures)
+        deletion.cancel_queued()
+        report_cancelled(scope, 'deletions (VMs already powered off stay off)')
+        print(deletion.summary())
         # update internal server list
-        run_async_job(method='get_servers')
+        run_async_job(method=inventory.refresh, dcs=results.keys())
+
+    @staticmethod
+    def do_sshrun(args):
+        """Run a command over SSH on every VM matching a name. See sshrun -h for help."""
+        parser = argparse.ArgumentParser(prog='sshrun', add_help=True)
+        parser.add_argument('--dc', type=str, help='ID of the datacenter.', default=None)
+        parser.add_argument('--name', type=str, help='The name of the vm(s) to run the command on.', required=True)
+        parser.add_argument('--username', type=str, help='SSH username.', default='root')
+        parser.add_argument('--password', type=str, help='SSH password.', required=True)
+        parser.add_argument('--parallelism', type=int, help='Hosts contacted at the same time.', default=20)
+        parser.add_argument('--timeout', type=int, help='Seconds without output before a host times out.',
+                            default=60)
+        parser.add_argument('--stream', help='Print output lines as they arrive.', default=False,
+                            action='store_true')
+        parser.add_argument('command', nargs=argparse.REMAINDER, help='The command to run.')
+        try:
+            p = parser.parse_args(shlex.split(args))
+        except:
+            return -1
+        hosts = vm_hosts(p.name, p.dc)
+        ssh_pool.username = p.username
+        ssh_pool.password = p.password
+        callback = None
+        if p.stream is True:
+            callback = lambda host, name, line: print_line('[%s] %s' % (hosts[host], line))
+        with CancelScope() as scope:
+            results = ssh_pool.fan_out(hosts.keys(), ' '.join(p.command), parallelism=p.parallelism,
+                                       timeout=p.timeout, callback=callback)
+        if scope.cancelled is True:
+            return report_cancelled(scope, 'hosts')
+        for host in sorted(results, key=hosts.get):
+            result = results[host]
+            ok = result['status'] == 'OK' and result.get('exit_status') == 0
+            if ok is False:
+                mark_failed()
+            cprint('%s (%s): %s exit status: %s in %.1fs' % (hosts[host], host, result['status'],
+                                                              result.get('exit_status'), result['elapsed']),
+                   'green' if ok else 'red')
+            for line in result.get('stdout', []) + result.get('stderr', []):
+                print('  %s' % line)
+
+    @staticmethod
+    def do_sshput(args):
+        """Copy files over SSH to every VM matching a name, skipping identical ones. See sshput -h for help."""
+        parser = argparse.ArgumentParser(prog='sshput', add_help=True)
+        parser.add_argument('--dc', type=str, help='ID of the datacenter.', default=None)
+        parser.add_argument('--name', type=str, help='The name of the vm(s) to copy the files to.', required=True)
+        parser.add_argument('--username', type=str, help='SSH username.', default='root')
+        parser.add_argument('--password', type=str, help='SSH password.', required=True)
+        parser.add_argument('--parallelism', type=int, help='Hosts contacted at the same time.', default=20)
+        parser.add_argument('--timeout', type=int, help='Seconds without output before a remote command times out.',
+                            default=60)
+        parser.add_argument('files', nargs='+', help='Files to copy, as local_path:remote_path.')
+        try:
+            p = parser.parse_args(shlex.split(args))
+            files = [tuple(f.split(':', 1)) for f in p.files]
+            for source, _ in files:
+                assert os.path.isfile(source), 'No such file: %s' % source
+        except AssertionError as e:
+            print(e)
+            return -1
+        except:
+            return -1
+        hosts = vm_hosts(p.name, p.dc)
+        ssh_pool.username = p.username
+        ssh_pool.password = p.password
+        with CancelScope() as scope:
+            results, summary = ssh_pool.distribute(hosts.keys(), files, parallelism=p.parallelism,
+                                                   timeout=p.timeout)
+        if scope.cancelled is True:
+            return report_cancelled(scope, 'hosts')
+        for host in sorted(results, key=hosts.get):
+            result = results[host]
+            cprint('%s (%s): %s %s in %.1fs' % (hosts[host], host, result['status'],
+                                                 result.get('error', result['files']), result['elapsed']),
+                   'green' if result['status'] == 'OK' else 'red')
+        print('Hosts: %s (failed: %s) files sent: %s skipped: %s %.1f MB in %.1fs (%.2f MB/s)' %
+              (summary['hosts'], summary['failed_hosts'], summary['sent'], summary['skipped'],
+               summary['bytes'] / 1048576.0, summary['elapsed'], summary['throughput'] / 1048576.0))
+        if summary['failed_hosts'] > 0:
+            return -1
+
+    @staticmethod
+    def do_inventory(args):
+        """Show and tune the local VM inventory. See inventory -h for help."""
+        parser = argparse.ArgumentParser(prog='inventory', add_help=True)
+        parser.add_argument('--ttl', type=int, help='Seconds before a datacenter inventory is refreshed.',
+                            default=None)
+        parser.add_argument('--interval', type=int, default=None,
+                            help='Refresh stale datacenters in background every N seconds, 0 to disable.')
+        parser.add_argument('--refresh', help='Reload the inventory of every datacenter now.', default=False,
+                            action='store_true')
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        if p.ttl is not None:
+            inventory.ttl = p.ttl
+        if p.interval is not None:
+            if p.interval > 0:
+                inventory.start(p.interval)
+            else:
+                inventory.stop()
+        load_inventory(loggedin_dc(), p.refresh)
+        for dc in sorted(loggedin_dc()):
+            print('Datacenter: %s VMs: %s age: %.0fs (ttl: %ss)' %
+                  (dc, len(inventory.vms(dc)), inventory.age(dc) or 0, inventory.ttl))
+
+    @staticmethod
+    def do_stats(args):
+        """Show API call latencies, errors, queue depth and worker usage. See stats -h for help."""
+        parser = argparse.ArgumentParser(prog='stats', add_help=True)
+        parser.add_argument('--format', type=str, choices=['text', 'json', 'prometheus'], default='text',
+                            help='Output format.')
+        parser.add_argument('--output', type=str, default=None, help='Write the stats to this file.')
+        parser.add_argument('--reset', help='Clear the collected latencies and errors.', default=False,
+                            action='store_true')
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        if p.format == 'prometheus':
+            text = metrics.prometheus()
+        elif p.format == 'json':
+            text = json.dumps(metrics.snapshot(), indent=2) + '\n'
+        else:
+            snapshot = metrics.snapshot()
+            lines = ['%-4s %-16s %8s %7s %9s %9s %9s' % ('DC', 'Method', 'Calls', 'Errors', 'Avg(s)', 'p50(s)',
+                                                           'p99(s)')]
+            for call in snapshot['calls']:
+                lines.append('%-4s %-16s %8s %7s %9.3f %9s %9s' % (call['dc'], call['method'], call['count'],
+                                                                    call['errors'], call['avg'], call['p50'],
+                                                                    call['p99']))
+            for name, value in sorted(snapshot['gauges'].items()):
+                values = ', '.join('%s=%s' % (k, round(v, 1)) for k, v in sorted(value.items()))
+                lines.append('%s: %s' % (name, values))
+            text = '\n'.join(lines) + '\n'
+        if p.output is not None:
+            with open(p.output, 'w') as output:
+                output.write(text)
+        else:
+            sys.stdout.write(text)
+        if p.reset is True:
+            metrics.reset()
+
+    @staticmethod
+    def do_watch(args):
+        """Poll the datacenters and print the VMs added, removed or changed. See watch -h for help."""
+        parser = argparse.ArgumentParser(prog='watch', add_help=True)
+        parser.add_argument('--dc', type=str, default=None, help='ID of the datacenter, all if omitted.')
+        parser.add_argument('--name', type=str, default=None, help='Only watch the VMs whose name contains this.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls after a change.')
+        parser.add_argument('--max-interval', type=float, dest='max_interval', default=60,
+                            help='Longest seconds between polls while nothing changes.')
+        parser.add_argument('--count', type=int, default=0, help='Stop after this many polls, 0 to run until Ctrl-C.')
+        parser.add_argument('--format', type=str, choices=['text', 'jsonl'], default='text', help='Output format.')
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        dcs = [p.dc] if p.dc is not None else loggedin_dc()
+        watcher = Watcher(watch_fields, p.interval, p.max_interval)
+
+        def poll(dc):
+            inventory.refresh(dc)
+            return [vm_row(dc, vm) for vm in inventory.find(p.name, dcs=[dc])]
+
+        polls = 0
+        try:
+            while p.count <= 0 or polls < p.count:
+                results = run_async_job(method=poll, dcs=dcs)
+                first = watcher.snapshot is None
+                changes = watcher.update([row for rows in results.values() for row in rows], results.keys())
+                polls += 1
+                if first is True and p.format == 'text':
+                    print('Watching %s VMs in DC: %s' % (watcher.size(), ', '.join(sorted(results))))
+                for change in changes:
+                    if p.format == 'jsonl':
+                        change['time'] = time.time()
+                        print(json.dumps(change))
+                        continue
+                    details = ', '.join('%s: %s -> %s' % (field, before, after)
+                                        for field, (before, after) in sorted(change['fields'].items())
+                                        if change['change'] == 'changed')
+                    print(('%s %s DC: %s %s (sid: %s) %s' % (time.strftime('%H:%M:%S'), watch_marks[change['change']],
+                                                            change['dc'], change['name'], change['sid'],
+                                                            details)).rstrip())
+                sys.stdout.flush()
+                if p.count <= 0 or polls < p.count:
+                    time.sleep(watcher.interval)
+        except KeyboardInterrupt:
+            print('Watch stopped after %s polls.' % polls)
+
+    @staticmethod
+    def do_health(args):
+        """Show the datacenter circuit breakers or set the fan-out deadline and retries. See health -h for help."""
+        global dc_deadline, dc_retries, dc_failure_threshold, dc_cooldown
+        parser = argparse.ArgumentParser(prog='health', add_help=True)
+        parser.add_argument('--deadline', type=float, default=None, help='Seconds a datacenter has to answer.')
+        parser.add_argument('--retries', type=int, default=None, help='Retries of a transient error.')
+        parser.add_argument('--threshold', type=int, default=None, help='Failures in a row opening the circuit.')
+        parser.add_argument('--cooldown', type=float, default=None, help='Seconds a circuit stays open.')
+        parser.add_argument('--reset', help='Close every circuit.', default=False, action='store_true')
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        dc_deadline = p.deadline if p.deadline is not None else dc_deadline
+        dc_retries = p.retries if p.retries is not None else dc_retries
+        dc_failure_threshold = p.threshold if p.threshold is not None else dc_failure_threshold
+        dc_cooldown = p.cooldown if p.cooldown is not None else dc_cooldown
+        for breaker in dc_breakers.values():
+            breaker.threshold, breaker.cooldown = dc_failure_threshold, dc_cooldown
+            if p.reset is True:
+                breaker.reset()
+        print('Deadline: %ss retries: %s threshold: %s cooldown: %ss' %
+              (dc_deadline, dc_retries, dc_failure_threshold, dc_cooldown))
+        print('%-4s %-10s %8s %9s' % ('DC', 'Circuit', 'Failures', 'Retry in'))
+        for dc in sorted(loggedin_dc()):
+            breaker = dc_breaker(dc)
+            print('%-4s %-10s %8s %9d' % (dc, breaker.state, breaker.failures, breaker.retry_in()))
+
+    @staticmethod
+    def do_coalesce(args):
+        """Show or set how long coalesced API results are reused. See coalesce -h for help."""
+        parser = argparse.ArgumentParser(prog='coalesce', add_help=True)
+        for name in sorted(coalesce_ttl):
+            parser.add_argument('--%s-ttl' % name.replace('_', '-'), type=float, dest=name, default=None,
+                                help='Seconds a %s result is reused, 0 only shares the calls in flight.' % name)
+        try:
+            p = parser.parse_args(args.split())
+        except:
+            return -1
+        for name in coalesce_ttl:
+            if getattr(p, name) is not None:
+                coalesce_ttl[name] = getattr(p, name)
+                for dc in pool.values():
+                    call = getattr(dc, name, None)
+                    if isinstance(call, SingleFlight):
+                        call.ttl = coalesce_ttl[name]
+                        call.invalidate()
+        print('%-4s %-10s %6s %8s %8s %8s' % ('DC', 'Method', 'TTL', 'Calls', 'Shared', 'Cached'))
+        for dc in loggedin_dc():
+            for name in sorted(coalesce_ttl):
+                call = getattr(pool[dc], name, None)
+                if isinstance(call, SingleFlight):
+                    print('%-4s %-10s %6s %8s %8s %8s' % (dc, name, call.ttl, call.calls, call.shared, call.cached))
+
+    @staticmethod
+    def do_wait(args):
+        """Wait until every queued VM creation and readiness probe is done."""
+        wait_for_provisioning()
+        print(provisioning.summary())
+        if readiness is not None:
+            print(readiness.summary())
 
     """
     @staticmethod
@@ -478,24 +1534,145 @@ class IConsole(Cmd, object):
     """
 
 
+class ThreadOutput(object):
+    """sys.stdout replacement sending what a capturing thread writes to its own buffer."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.buffer = StringIO.StringIO()
+
+    def release(self):
+        buf = self._local.buffer
+        del self._local.buffer
+        return buf.getvalue()
+
+    def write(self, data):
+        getattr(self._local, 'buffer', self.stream).write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class ScriptRunner(object):
+    """Run console commands read from a stream, without prompt.
+
+    Consecutive read only commands (listed in parallel) run in parallel, any
+    other command runs alone, after every command above it, so changes are
+    applied in the order of the script. One JSON line per command is written
+    to output, with status error when the command failed or reported a
+    failure. VM creations finish in background: once they are all done, an
+    extra error line is written for each command some creations of failed.
+    """
+    parallel = ('showvm', 'findip', 'findtemplate', 'health', 'stats')
+
+    def __init__(self, stream, output, parallelism=6):
+        self.stream = stream
+        self.output = output
+        self.parallelism = parallelism
+        self.ok = True
+        self.creations = []
+
+    def execute(self, lineno, line):
+        started = time.time()
+        record = {'line': lineno, 'command': line, 'status': 'ok'}
+        command_state.failed = False
+        command_state.creations = []
+        sys.stdout.capture()
+        try:
+            console, line_cmd = IConsole(), line
+            if line.split()[0] == 'create':
+                console, line_cmd = Creator(), line.partition(' ')[2]
+            if not hasattr(console, 'do_%s' % (line_cmd.split() or [''])[0]):
+                raise ValueError('Unknown command: %s' % line_cmd)
+            result = console.onecmd(line_cmd)
+            if result == -1 or command_state.failed is True:
+                record['status'] = 'error'
+            elif result is not None:
+                record['result'] = result
+        except SystemExit as e:
+            # argparse exits on invalid arguments
+            record.update({'status': 'error', 'error': 'exit status %s' % e.code})
+        except Exception as e:
+            record.update({'status': 'error', 'error': str(e)})
+        finally:
+            record['output'] = sys.stdout.release().splitlines()
+            if len(command_state.creations) > 0:
+                self.creations.append((lineno, line, command_state.creations))
+            command_state.creations = None
+        record['elapsed'] = round(time.time() - started, 3)
+        return record
+
+    def write(self, record):
+        self.ok = self.ok and record['status'] == 'ok'
+        self.output.write(json.dumps(record, default=str) + '\n')
+        self.output.flush()
+
+    def run_group(self, group):
+        with WorkerPool(min(self.parallelism, len(group))) as workers:
+            futures = [workers.submit(self.execute, lineno, line) for lineno, line in group]
+            for future in futures:
+                self.write(future.result())
+
+    def report_creations(self):
+        """Write an error record for every command whose VM creations did not all succeed."""
+        for lineno, line, futures in self.creations:
+            failed = len([f for f in futures if not succeeded_future(f)])
+            if failed > 0:
+                self.write({'line': lineno, 'command': line, 'status': 'error', 'output': [],
+                            'error': '%s of %s VM creations failed' % (failed, len(futures))})
+
+    def run(self):
+        """Run the whole stream, return True if every command succeeded."""
+        group = []
+        for lineno, line in enumerate(self.stream, 1):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            if line.split()[0] in self.parallel:
+                group.append((lineno, line))
+            else:
+                self.run_group(group)
+                self.run_group([(lineno, line)])
+                group = []
+        self.run_group(group)
+        # VM creations are asynchronous, let them finish before exiting
+        wait_for_provisioning()
+        self.report_creations()
+        return self.ok
+
+
 if __name__ == '__main__':
-    for x in xrange(1, dc_number+1):
-        logger.debug('Starting Worker Thread: %s' % x)
-        vmw_t = VMWorker()
-        vmw_tq.append(vmw_t)
-        vmw_t.setDaemon(True)
-        vmw_t.start()
-    for cr in xrange(3):
-        logger.debug('Starting Creator Thread: %s' % cr)
-        c = CreatorWorker()
-        creators_tq.append(c)
-        c.setDaemon(True)
-        c.start()
+    main_parser = argparse.ArgumentParser(description='Aruba Cloud Python Console')
+    main_parser.add_argument('--script', type=str, default=None,
+                             help='Run the console commands of a file, - for stdin, and print a JSON line each.')
+    main_parser.add_argument('--parallelism', type=int, default=6,
+                             help='Read only commands run at the same time in script mode.')
+    options = main_parser.parse_args()
+
+    start_workers()
 
-    console = IConsole()
-    console.cmdloop()
+    exit_status = 0
+    if options.script is None:
+        console = IConsole()
+        console.cmdloop()
+    else:
+        results_output = sys.stdout
+        # keep stdout for the JSON results, anything not captured goes to stderr
+        sys.stdout = ThreadOutput(sys.stderr)
+        script = sys.stdin if options.script == '-' else open(options.script)
+        with script:
+            if ScriptRunner(script, results_output, options.parallelism).run() is not True:
+                exit_status = 1
 
-    for t in vmw_tq:
-        t.stop = True
-    for t in creators_tq:
-        t.stop = True
+    for dc in sorted(ip_pools):
+        for ip in ip_pools[dc].drain(release=ip_release_at_exit):
+            print('%s unused public IP in DC: %s: %s' %
+                  ('Released' if ip_release_at_exit else 'Kept', dc, getattr(ip, 'ip_addr', ip.resid)))
+    if readiness is not None:
+        readiness.close()
+    ssh_pool.close()
+    stop_workers()
+    sys.exit(exit_status)
@@ -0,0 +1,222 @@
+import itertools
+import random
+import threading
+import time
+
+
+class FakeVM(object):
+
+    def __init__(self, interface, sid, name, ip, template_id, package='small'):
+        self.interface = interface
+        self.sid = sid
+        self.vm_name = name
+        self.ip_addr = ip
+        self.template_id = template_id
+        self.package = package
+        self.cpu_qty = 1
+        self.ram_qty = 1
+        self.hds = []
+        self.status = 3
+
+    def poweroff(self):
+        return self.interface.poweroff_server(server_id=self.sid)
+
+    def poweron(self):
+        return self.interface.poweron_server(server_id=self.sid)
+
+    def __repr__(self):
+        return 'VM %s (sid: %s ip: %s)' % (self.vm_name, self.sid, self.ip_addr)
+
+
+class FakeVMList(list):
+    last_search_result = []
+
+    def find(self, pattern):
+        self.last_search_result = [vm for vm in self if pattern in vm.vm_name]
+        return self.last_search_result
+
+    def find_ip(self, ip):
+        for vm in self:
+            if vm.ip_addr == ip:
+                return vm
+        return None
+
+
+class FakeTemplate(object):
+
+    def __init__(self, template_id, name, hypervisor):
+        self.template_id = template_id
+        self.name = name
+        self.descr = '%s template' % name
+        self.hypervisor = hypervisor
+        self.enabled = True
+
+
+class FakeIp(object):
+
+    def __init__(self, resid, ip):
+        self.resid = resid
+        self.ip_addr = ip
+
+
+class FakeCreator(object):
+    """Stand-in for the ArubaCloud VM creators, committing to a FakeCloudInterface."""
+
+    def __init__(self, interface, name, template_id):
+        self.interface = interface
+        self.name = name
+        self.template_id = template_id
+
+    def add_public_ip(self, resid):
+        pass
+
+    def commit(self, url=None):
+        return self.interface.create_server(self.name, self.template_id)
+
+
+class FakeCloudInterface(object):
+    """In-process stand-in for CloudInterface, used as the base of Console.Datacenter by the benchmarks.
+
+    Every API call sleeps latency seconds (plus or minus jitter) and is
+    counted in calls. Power, delete and create calls register a job that
+    lasts job_duration seconds.
+    """
+    _sids = itertools.count(1)
+    hypervisors = {3: 'LC', 4: 'SMART', 2: 'VW', 1: 'HV'}
+    # like CloudInterface, servers are only listed by get_servers
+    vmlist = FakeVMList()
+
+    def __init__(self, dc, vms=0, latency=0.05, jitter=0.2, job_duration=1.0, templates=50, seed=None):
+        self.dc = str(dc)
+        self.latency = latency
+        self.jitter = jitter
+        self.job_duration = job_duration
+        self.wcf_baseurl = 'fake://dc%s' % dc
+        self.auth = None
+        self.calls = {}
+        self.templates = []
+        self._templates = [FakeTemplate(i, 'template-%s' % i, ('VW', 'HV', 'SMART')[i % 3]) for i in xrange(templates)]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._servers = {}
+        self._jobs = {}
+        self._job_ids = itertools.count(1)
+        self._loggedin = False
+        for i in xrange(vms):
+            self._add_server('vm-%s-%05d' % (self.dc, i), i % len(self._templates) if templates else 0)
+
+    def _call(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _add_server(self, name, template_id):
+        sid = next(self._sids)
+        ip = '10.%s.%s.%s' % (int(self.dc) % 256, (sid // 256) % 256, sid % 256)
+        with self._lock:
+            self._servers[sid] = FakeVM(self, sid, name, ip, template_id)
+        return sid
+
+    def _add_job(self, sid, name):
+        with self._lock:
+            job_id = next(self._job_ids)
+            self._jobs[job_id] = {'JobId': job_id, 'ServerId': sid, 'ServerName': name,
+                                  'ends': time.time() + self.job_duration}
+            return job_id
+
+    def api_calls(self):
+        return sum(self.calls.values())
+
+    def is_logged_in(self):
+        return self._loggedin
+
+    def login(self, username, password, load=True):
+        self._call('login')
+        self.auth = (username, password)
+        self._loggedin = True
+        if load is True:
+            self.get_ip()
+            self.get_servers()
+        return True
+
+    def get_servers(self):
+        self._call('get_servers')
+        with self._lock:
+            self.vmlist = FakeVMList(self._servers.values())
+        return True
+
+    def get_ip(self):
+        self._call('get_ip')
+        return []
+
+    def get_vm(self, pattern=None):
+        self._call('get_vm')
+        if len(self.vmlist) == 0:
+            self.get_servers()
+        if pattern is None:
+            return self.vmlist
+        return self.vmlist.find(pattern)
+
+    def get_jobs(self):
+        self._call('get_jobs')
+        now = time.time()
+        with self._lock:
+            for job_id, job in self._jobs.items():
+                if job['ends'] <= now:
+                    del self._jobs[job_id]
+            return {'Value': [dict(job) for job in self._jobs.values()]}
+
+    def find_job(self, vm_name):
+        for job in self.get_jobs()['Value']:
+            if job['ServerName'] == vm_name:
+                return job
+        return 'JOBNOTFOUND'
+
+    def get_hypervisors(self):
+        self._call('get_hypervisors')
+        # like the real call, the templates are appended to the ones already loaded
+        self.templates.extend(self._templates)
+
+    def find_template(self, name=None, hv=None):
+        if name is None and hv is None:
+            raise Exception('Error, no pattern defined')
+        if len(self.templates) == 0:
+            self.get_hypervisors()
+        return [t for t in self.templates
+                if (name is None or name in t.descr) and (hv is None or t.hypervisor == self.hypervisors[hv])]
+
+    def poweroff_server(self, server=None, server_id=None):
+        self._call('poweroff_server')
+        sid = server.sid if server is not None else server_id
+        self._add_job(sid, self._servers[sid].vm_name)
+        return True
+
+    def poweron_server(self, server=None, server_id=None):
+        self._call('poweron_server')
+        sid = server.sid if server is not None else server_id
+        self._add_job(sid, self._servers[sid].vm_name)
+        return True
+
+    def delete_vm(self, server=None, server_id=None):
+        self._call('delete_vm')
+        sid = server.sid if server is not None else server_id
+        with self._lock:
+            vm = self._servers.pop(sid, None)
+        if vm is not None:
+            self._add_job(sid, vm.vm_name)
+        return True
+
+    def create_server(self, name, template_id):
+        self._call('commit')
+        self._add_job(self._add_server(name, template_id), name)
+        return True
+
+    def purchase_ip(self):
+        self._call('purchase_ip')
+        resid = next(self._job_ids)
+        return FakeIp(resid, '80.0.%s.%s' % ((resid // 256) % 256, resid % 256))
+
+    def remove_ip(self, ip_id):
+        self._call('remove_ip')
+        return True
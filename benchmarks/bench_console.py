@@ -0,0 +1,99 @@
+"""Console throughput benchmarks against the in-process fake Aruba Cloud backend.
+
+Console.Datacenter is rebased on FakeCloudInterface, so its metrics, call
+coalescing and lazy loading are part of what is measured. Run from the
+repository root, no network access is needed:
+
+    python benchmarks/bench_console.py --vms 2000 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Console
+from pyArubaConsole.helper.Executor import wait
+from FakeCloud import FakeCloudInterface, FakeCreator
+
+
+class BenchCloud(FakeCloudInterface):
+    """FakeCloudInterface configured from the command line options."""
+    options = None
+
+    def __init__(self, dc):
+        super(BenchCloud, self).__init__(dc, vms=self.options.vms, latency=self.options.latency,
+                                         job_duration=self.options.job_duration, seed=int(dc))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+def api_calls():
+    return sum(dc.api_calls() for dc in Console.pool.values())
+
+
+def bench(name, function, repeat=1):
+    """Run function repeat times and print ops/sec, latencies and API calls per op."""
+    latencies = []
+    calls = api_calls()
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    started = time.time()
+    try:
+        for i in xrange(repeat):
+            t = time.time()
+            function(i)
+            latencies.append(time.time() - t)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    elapsed = time.time() - started
+    print('%-28s %6s %10.2f %10.4f %10.4f %10.1f' % (name, repeat, repeat / elapsed, percentile(latencies, 0.5),
+                                                      percentile(latencies, 0.99), (api_calls() - calls) / float(repeat)))
+
+
+def create(count):
+    params = Console.smart_parser().parse_args(['1', 'bench', '1', 'x', str(count), 'small'])
+    wait(Console.provision('smart', params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the console against a fake backend.')
+    parser.add_argument('--dcs', type=int, default=6, help='Number of datacenters.')
+    parser.add_argument('--vms', type=int, default=2000, help='VMs per datacenter.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per API call.')
+    parser.add_argument('--job-duration', type=float, default=0.5, dest='job_duration',
+                        help='Seconds a power, delete or create job lasts.')
+    parser.add_argument('--repeat', type=int, default=20, help='Repetitions of the read benchmarks.')
+    parser.add_argument('--creates', type=int, default=30, help='VMs created by the creation benchmark.')
+    options = parser.parse_args()
+
+    BenchCloud.options = options
+    Console.Datacenter.__bases__ = (BenchCloud,)
+    for dc in xrange(1, options.dcs + 1):
+        Console.pool[str(dc)] = Console.Datacenter(str(dc))
+        Console.pool[str(dc)].login('bench', 'bench', load=False)
+    Console.build_creator = lambda vm_type, vm_name, params: (
+        FakeCreator(Console.pool[params.dc], vm_name, params.template), None)
+    Console.api_rate.rate = 0
+    Console.start_workers()
+    console = Console.IConsole()
+
+    print('%d DCs x %d VMs, %.3fs per API call, %.2fs per job' %
+          (options.dcs, options.vms, options.latency, options.job_duration))
+    print('%-28s %6s %10s %10s %10s %10s' % ('Benchmark', 'Ops', 'Ops/s', 'p50(s)', 'p99(s)', 'Calls/op'))
+    bench('run_async_job get_servers', lambda i: Console.run_async_job(method='get_servers'), 3)
+    bench('showvm (inventory)', lambda i: console.do_showvm('--name vm-1-0001'), options.repeat)
+    bench('showvm --nocache', lambda i: console.do_showvm('--name vm-1-0001 --nocache'), options.repeat)
+    bench('findip all (inventory)', lambda i: console.do_findip('all 10.1.0.%s' % (i + 1)), options.repeat)
+    bench('poweroff 10 VMs', lambda i: console.do_poweroff('--dc 2 --name vm-2-000%s' % i), 3)
+    bench('deletevm 10 VMs', lambda i: console.do_deletevm('--dc 3 --name vm-3-000%s' % i), 3)
+    bench('create %s VMs' % options.creates, lambda i: create(options.creates), 1)
+    Console.stop_workers()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+import Queue
+import collections
+import sys
+import threading
+import time
+
+
+class CancelledError(Exception):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class Future(object):
+    """Placeholder for the result of a call queued to a worker thread."""
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    CANCELLED = 'CANCELLED'
+    FINISHED = 'FINISHED'
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._state = self.PENDING
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def cancel(self):
+        with self._condition:
+            if self._state in (self.RUNNING, self.FINISHED):
+                return False
+            if self._state == self.PENDING:
+                self._state = self.CANCELLED
+                self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == self.CANCELLED
+
+    def running(self):
+        return self._state == self.RUNNING
+
+    def done(self):
+        return self._state in (self.CANCELLED, self.FINISHED)
+
+    def set_cancelled(self):
+        """Mark a running future cancelled, when what it stands for was cancelled before doing anything."""
+        with self._condition:
+            if self._state == self.FINISHED:
+                return
+            self._state = self.CANCELLED
+            self._condition.notify_all()
+        self._run_callbacks()
+
+    def set_running_or_notify_cancel(self):
+        with self._condition:
+            if self._state == self.CANCELLED:
+                return False
+            self._state = self.RUNNING
+            return True
+
+    def set_result(self, result):
+        with self._condition:
+            if self._state == self.CANCELLED:
+                return
+            self._result = result
+            self._state = self.FINISHED
+            self._condition.notify_all()
+        self._run_callbacks()
+
+    def set_exception(self, exc_info):
+        with self._condition:
+            if self._state == self.CANCELLED:
+                return
+            self._exc_info = exc_info
+            self._state = self.FINISHED
+            self._condition.notify_all()
+        self._run_callbacks()
+
+    def add_done_callback(self, fn):
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                pass
+
+    def _wait(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self.done():
+                if deadline is None:
+                    # a finite wait keeps the calling thread responsive to Ctrl-C
+                    self._condition.wait(1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError('Future not done after %s seconds.' % timeout)
+                    self._condition.wait(remaining)
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._state == self.CANCELLED:
+            raise CancelledError()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        if self._state == self.CANCELLED:
+            raise CancelledError()
+        return None if self._exc_info is None else self._exc_info[1]
+
+
+class QueueWorker(threading.Thread):
+    """Thread blocking on a queue of (future, function, args, kwargs) items.
+
+    A None item stops the worker.
+    """
+
+    def __init__(self, queue, logger=None):
+        super(QueueWorker, self).__init__()
+        self.queue = queue
+        self.logger = logger
+        self.stop = False
+        self.busy = 0.0
+        self.idle = 0.0
+        self._waiting_since = None
+
+    def idle_time(self):
+        """Seconds spent waiting for work, including the current wait."""
+        waiting_since = self._waiting_since
+        return self.idle + (time.time() - waiting_since if waiting_since is not None else 0)
+
+    def run(self):
+        while self.stop is False:
+            self._waiting_since = time.time()
+            item = self.queue.get()
+            started = time.time()
+            self.idle += started - self._waiting_since
+            self._waiting_since = None
+            try:
+                if item is None:
+                    break
+                self.execute(*item)
+            finally:
+                self.busy += time.time() - started
+                self.queue.task_done()
+
+    def execute(self, future, function, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        if self.logger is not None:
+            self.logger.debug('Entering Thread %s with method: %s args: %s' %
+                              (self.__class__.__name__, function, args))
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            # even SystemExit or KeyboardInterrupt resolve the future and keep the worker alive
+            if self.logger is not None:
+                self.logger.debug('Method: %s raised: %s' % (function, sys.exc_info()[1]))
+            future.set_exception(sys.exc_info())
+        else:
+            future.set_result(result)
+
+
+def enqueue(queue, function, *args, **kwargs):
+    """Put a call on a worker queue and return its Future.
+
+    The Future joins the CancelScope active in the calling thread, if any.
+    """
+    if not hasattr(function, '__call__'):
+        raise TypeError('Function passed to thread is not a function.')
+    future = Future()
+    scope = CancelScope.current()
+    if scope is not None:
+        scope.add(future)
+    queue.put((future, function, args, kwargs))
+    return future
+
+
+def join(queue):
+    """Block until every item put on queue is done, like Queue.join but responsive to Ctrl-C."""
+    with queue.all_tasks_done:
+        while queue.unfinished_tasks > 0:
+            queue.all_tasks_done.wait(1)
+
+
+def _copy_outcome(source, target):
+    if source.cancelled():
+        target.set_cancelled()
+    elif source._exc_info is not None:
+        target.set_exception(source._exc_info)
+    else:
+        target.set_result(source._result)
+
+
+def chain(future, queue, function, *args):
+    """Return a Future of function(future's result, *args), run on queue once future is done.
+
+    When function returns a Future, the chained Future follows its outcome, so
+    steps waiting on something else hold no thread meanwhile. Exceptions and
+    cancellation of future are passed on, and cancelling the chained Future
+    skips the steps not started yet.
+    """
+    chained = Future()
+
+    def step(result):
+        if chained.cancelled():
+            return
+        outcome = function(result, *args)
+        if isinstance(outcome, Future):
+            outcome.add_done_callback(lambda f: _copy_outcome(f, chained))
+            chained.add_done_callback(lambda f: f.cancelled() and outcome.cancel())
+        else:
+            chained.set_result(outcome)
+
+    def run(source):
+        if source.cancelled() or source._exc_info is not None:
+            _copy_outcome(source, chained)
+        elif not chained.cancelled():
+            step_future = Future()
+            step_future.add_done_callback(lambda f: f._exc_info is not None and _copy_outcome(f, chained))
+            queue.put((step_future, step, (source._result,), {}))
+    future.add_done_callback(run)
+    return chained
+
+
+class Window(object):
+    """Keeps at most limit asynchronous operations running at once.
+
+    submit(start, *args) returns a Future following the Future returned by
+    start(*args), which is only called once a running operation finished.
+    Cancelling the returned Future before then skips the operation, once
+    started it is running and cannot be cancelled. The operation joins the
+    CancelScope current at submit time, if any.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.running = 0
+        self._waiting = collections.deque()
+        self._lock = threading.Lock()
+
+    def submit(self, start, *args):
+        future = Future()
+        with self._lock:
+            self._waiting.append((future, start, args, CancelScope.current()))
+        self._next()
+        return future
+
+    def _next(self):
+        with self._lock:
+            if self.running >= self.limit or len(self._waiting) == 0:
+                return
+            future, start, args, scope = self._waiting.popleft()
+            self.running += 1
+        if not future.set_running_or_notify_cancel():
+            self._finished()
+            return
+        try:
+            operation = start(*args)
+        except Exception:
+            future.set_exception(sys.exc_info())
+            self._finished()
+            return
+        if scope is not None:
+            scope.add(operation)
+        operation.add_done_callback(lambda f: (_copy_outcome(f, future), self._finished()))
+
+    def _finished(self):
+        with self._lock:
+            self.running -= 1
+        self._next()
+
+    def resize(self, limit):
+        """Change the limit, starting waiting operations if it grew."""
+        with self._lock:
+            self.limit = max(1, limit)
+            free = self.limit - self.running
+        for _ in xrange(free):
+            self._next()
+
+
+class CancelScope(object):
+    """Futures cancelled together, e.g. the calls of one bulk command.
+
+    Within a with block, the futures created by enqueue in the same thread
+    join the scope. A KeyboardInterrupt (Ctrl-C) in the block cancels every
+    future of the scope not yet done and is not propagated, cancelled tells
+    whether it happened.
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        self.cancelled = False
+        self._futures = []
+        self._lock = threading.Lock()
+        self._parent = None
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._local, 'scope', None)
+
+    def add(self, future):
+        with self._lock:
+            self._futures.append(future)
+        if self.cancelled is True:
+            future.cancel()
+        return future
+
+    def cancel(self):
+        """Cancel the futures of the scope, return how many were cancelled."""
+        self.cancelled = True
+        with self._lock:
+            futures, self._futures = self._futures, []
+        # newest first, so that no queued operation starts when an older one is cancelled
+        return len([f for f in reversed(futures) if f.cancel()])
+
+    def __enter__(self):
+        self._parent = self.current()
+        self._local.scope = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._local.scope = self._parent
+        if exc_type is KeyboardInterrupt:
+            self.cancel()
+            return True
+        return False
+
+
+def wait(futures, timeout=None):
+    """Block until all futures are done, return the (done, not_done) lists."""
+    deadline = None if timeout is None else time.time() + timeout
+    done, not_done = [], []
+    for future in futures:
+        try:
+            future._wait(None if deadline is None else max(0, deadline - time.time()))
+            done.append(future)
+        except TimeoutError:
+            not_done.append(future)
+    return done, not_done
+
+
+def as_completed(futures, timeout=None):
+    """Yield futures in the order they complete."""
+    futures = list(futures)
+    finished = Queue.Queue()
+    for future in futures:
+        future.add_done_callback(finished.put)
+    deadline = None if timeout is None else time.time() + timeout
+    for _ in xrange(len(futures)):
+        while True:
+            wait_for = 1 if deadline is None else min(1, deadline - time.time())
+            if wait_for <= 0:
+                raise TimeoutError('%s futures not done after %s seconds.' % (len(futures), timeout))
+            try:
+                yield finished.get(True, wait_for)
+                break
+            except Queue.Empty:
+                pass
+
+
+class WorkerPool(object):
+    """Pool of QueueWorker threads, started and stopped by a with block or by start() and stop()."""
+
+    def __init__(self, size, logger=None):
+        self.queue = Queue.Queue()
+        self.workers = [QueueWorker(self.queue, logger) for _ in xrange(max(1, size))]
+
+    def start(self):
+        for worker in self.workers:
+            worker.setDaemon(True)
+            worker.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Let the workers exit once the queued calls are done, waiting up to timeout seconds if given."""
+        for _ in self.workers:
+            self.queue.put(None)
+        if timeout is not None:
+            deadline = time.time() + timeout
+            for worker in self.workers:
+                worker.join(max(0, deadline - time.time()))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def submit(self, function, *args, **kwargs):
+        return enqueue(self.queue, function, *args, **kwargs)
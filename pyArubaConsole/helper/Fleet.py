@@ -0,0 +1,117 @@
+import json
+import re
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+def load_spec(path):
+    """Read a fleet spec from a JSON file, or a YAML one when PyYAML is
+    installed, and return its validated groups."""
+    with open(path) as stream:
+        text = stream.read()
+    if path.endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise ValueError('PyYAML is needed to read %s, install it or use a JSON spec.' % path)
+        return parse_spec(yaml.safe_load(text))
+    return parse_spec(json.loads(text))
+
+
+def parse_spec(data):
+    """Validate a fleet spec: a list of groups, or a dict holding them under
+    groups along with default values for every group.
+
+    A group is a number (count) of VMs named name-01, name-02... in one
+    datacenter (dc), all of the same type (smart with a package, or pro with
+    cpu, ram, disks and buyip) and template, with admin_pwd as password.
+    """
+    defaults = {}
+    groups = data
+    if isinstance(data, dict):
+        defaults = dict((key, value) for key, value in data.items() if key != 'groups')
+        groups = data.get('groups')
+    if not isinstance(groups, list):
+        raise ValueError('A fleet spec needs a list of groups.')
+    validated = []
+    seen = set()
+    for i, group in enumerate(groups, 1):
+        if not isinstance(group, dict):
+            raise ValueError('Group %s is not a mapping.' % i)
+        merged = dict(defaults)
+        merged.update(group)
+        missing = [key for key in ('dc', 'name', 'count', 'type', 'template', 'admin_pwd') if key not in merged]
+        if len(missing) > 0:
+            raise ValueError('Group %s misses: %s.' % (i, ', '.join(missing)))
+        merged['dc'] = str(merged['dc'])
+        merged['template'] = str(merged['template'])
+        merged['count'] = int(merged['count'])
+        if re.match(r'^[A-Za-z0-9][A-Za-z0-9-]*$', str(merged['name'])) is None:
+            raise ValueError('Group %s has an invalid name: %s.' % (i, merged['name']))
+        if merged['count'] < 0:
+            raise ValueError('Group %s has a negative count.' % i)
+        if merged['type'] == 'smart':
+            if 'package' not in merged:
+                raise ValueError('Smart group %s misses a package.' % i)
+        elif merged['type'] == 'pro':
+            merged['cpu'] = int(merged.get('cpu', 1))
+            merged['ram'] = int(merged.get('ram', 1))
+            merged['disks'] = [int(size) for size in merged.get('disks', [10])]
+            merged['buyip'] = bool(merged.get('buyip', False))
+            if not 1 <= len(merged['disks']) <= 4:
+                raise ValueError('Pro group %s needs 1 to 4 disks.' % i)
+        else:
+            raise ValueError('Group %s has an unknown type: %s.' % (i, merged['type']))
+        if (merged['dc'], merged['name']) in seen:
+            raise ValueError('Group %s repeats the name %s in DC: %s.' % (i, merged['name'], merged['dc']))
+        seen.add((merged['dc'], merged['name']))
+        validated.append(merged)
+    return validated
+
+
+def member_names(group):
+    return ['%s-%02d' % (group['name'], i) for i in xrange(1, group['count'] + 1)]
+
+
+def owns(group, name):
+    """Tell whether name is the name of a member of group, whatever its count: name-01, name-02..."""
+    prefix = '%s-' % group['name']
+    number = name[len(prefix):] if name.startswith(prefix) else ''
+    return number.isdigit() and int(number) > 0 and '%s%02d' % (prefix, int(number)) == name
+
+
+def desired_fields(group):
+    """Fields of a VM row a member of group is expected to have."""
+    if group['type'] == 'smart':
+        return {'type': 'smart', 'package': group['package'], 'template': group['template']}
+    return {'type': 'pro', 'cpu': group['cpu'], 'ram': group['ram'], 'template': group['template']}
+
+
+def plan(groups, rows):
+    """Diff the groups against the VMs of their datacenters.
+
+    rows(dc) must return the VM rows (dicts with name and sid at least) of a
+    datacenter. A group owns the VMs named like its members (see owns), so
+    members beyond its count are deleted when it shrinks. Return
+    the lists of (group, name) to create, of (group, row) to delete and of
+    (group, row, {field: (current, desired)}) members differing from their
+    group, which are only reported.
+    """
+    creates, deletes, drifts = [], [], []
+    for group in groups:
+        desired = member_names(group)
+        members = sorted([row for row in rows(group['dc']) if owns(group, row['name'])],
+                         key=lambda row: (row['name'], row['sid']))
+        present = set()
+        for row in members:
+            if row['name'] not in desired or row['name'] in present:
+                deletes.append((group, row))
+                continue
+            present.add(row['name'])
+            fields = dict((field, (row.get(field), value)) for field, value in desired_fields(group).items()
+                          if row.get(field) is not None and str(row.get(field)) != str(value))
+            if len(fields) > 0:
+                drifts.append((group, row, fields))
+        creates.extend((group, name) for name in desired if name not in present)
+    return creates, deletes, drifts
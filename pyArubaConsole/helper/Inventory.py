@@ -0,0 +1,201 @@
+import bisect
+import threading
+import time
+
+
+def vm_ips(vm):
+    """Return the ip addresses of a VM as a list of strings."""
+    value = getattr(vm, 'ip_addr', None)
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple, set)):
+        value = [value]
+    ips = []
+    for ip in value:
+        ip = getattr(ip, 'ip_addr', ip)
+        if ip:
+            ips.append(str(ip))
+    return ips
+
+
+class Inventory(object):
+    """In-memory index of the VMs of several datacenters.
+
+    fetch(dc) must return the full list of VMs of a datacenter. VMs are
+    indexed by exact name, name prefix, server id and ip address. A
+    datacenter older than ttl seconds is still served from memory while a
+    refresh runs through spawn(function, dc), which defaults to a thread.
+    Refreshes of one datacenter, in background or not, run one at a time.
+    """
+
+    def __init__(self, fetch, ttl=300, spawn=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.spawn = spawn or self._thread
+        self._lock = threading.RLock()
+        self._vms = {}
+        self._signatures = {}
+        self._loaded = {}
+        self._refreshing = set()
+        self._refresh_locks = {}
+        self._by_name = {}
+        self._by_ip = {}
+        self._names = []
+        self._timer = None
+
+    @staticmethod
+    def _thread(function, dc):
+        t = threading.Thread(target=function, args=(dc,))
+        t.setDaemon(True)
+        t.start()
+        return t
+
+    @staticmethod
+    def _signature(vm):
+        return vm.vm_name, tuple(vm_ips(vm))
+
+    def _index(self, key, vm):
+        name, ips = self._signature(vm)
+        if name not in self._by_name:
+            bisect.insort(self._names, name)
+        self._by_name.setdefault(name, set()).add(key)
+        for ip in ips:
+            self._by_ip.setdefault(ip, set()).add(key)
+
+    def _unindex(self, key, signature):
+        name, ips = signature
+        keys = self._by_name.get(name, set())
+        keys.discard(key)
+        if not keys:
+            self._by_name.pop(name, None)
+            i = bisect.bisect_left(self._names, name)
+            if i < len(self._names) and self._names[i] == name:
+                del self._names[i]
+        for ip in ips:
+            keys = self._by_ip.get(ip, set())
+            keys.discard(key)
+            if not keys:
+                self._by_ip.pop(ip, None)
+
+    def update(self, dc, vms):
+        """Replace the VMs of dc, reindexing only the ones that changed."""
+        with self._lock:
+            old = self._vms.setdefault(dc, {})
+            signatures = self._signatures.setdefault(dc, {})
+            new = dict((vm.sid, vm) for vm in vms)
+            for sid in old.keys():
+                if sid not in new:
+                    self._unindex((dc, sid), signatures.pop(sid))
+                    del old[sid]
+            for sid, vm in new.items():
+                signature = self._signature(vm)
+                if signatures.get(sid) != signature:
+                    if sid in signatures:
+                        self._unindex((dc, sid), signatures[sid])
+                    self._index((dc, sid), vm)
+                    signatures[sid] = signature
+                old[sid] = vm
+            self._loaded[dc] = time.time()
+
+    def _refresh_lock(self, dc):
+        with self._lock:
+            return self._refresh_locks.setdefault(dc, threading.Lock())
+
+    def refresh(self, dc):
+        try:
+            # fetch may reload a list shared by concurrent fetches of dc
+            with self._refresh_lock(dc):
+                self.update(dc, self.fetch(dc))
+        finally:
+            with self._lock:
+                self._refreshing.discard(dc)
+        return True
+
+    def refresh_in_background(self, dc):
+        with self._lock:
+            if dc in self._refreshing:
+                return
+            self._refreshing.add(dc)
+        self.spawn(self.refresh, dc)
+
+    def invalidate(self, dc=None):
+        with self._lock:
+            for d in ([dc] if dc is not None else self._loaded.keys()):
+                self._loaded.pop(d, None)
+
+    def drop(self, dc):
+        """Forget everything known about dc."""
+        with self._lock:
+            self.update(dc, [])
+            self._vms.pop(dc, None)
+            self._signatures.pop(dc, None)
+            self._loaded.pop(dc, None)
+
+    def loaded(self, dc):
+        return dc in self._loaded
+
+    def age(self, dc):
+        return time.time() - self._loaded[dc] if dc in self._loaded else None
+
+    def stale(self, dc):
+        return not self.loaded(dc) or self.age(dc) > self.ttl
+
+    def revalidate(self, dcs):
+        """Schedule a background refresh of the loaded datacenters past their ttl."""
+        for dc in dcs:
+            if self.loaded(dc) and self.stale(dc):
+                self.refresh_in_background(dc)
+
+    def start(self, interval):
+        """Refresh stale datacenters every interval seconds until stop()."""
+        self.stop()
+
+        def tick():
+            self.revalidate(self._vms.keys())
+            self.start(interval)
+        self._timer = threading.Timer(interval, tick)
+        self._timer.setDaemon(True)
+        self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _resolve(self, keys, dcs):
+        with self._lock:
+            return [self._vms[dc][sid] for dc, sid in sorted(keys)
+                    if (dcs is None or dc in dcs) and sid in self._vms.get(dc, {})]
+
+    def vms(self, dc):
+        with self._lock:
+            return self._vms.get(dc, {}).values()
+
+    def by_name(self, name, dcs=None):
+        return self._resolve(self._by_name.get(name, set()), dcs)
+
+    def by_prefix(self, prefix, dcs=None):
+        keys = set()
+        with self._lock:
+            i = bisect.bisect_left(self._names, prefix)
+            while i < len(self._names) and self._names[i].startswith(prefix):
+                keys.update(self._by_name[self._names[i]])
+                i += 1
+        return self._resolve(keys, dcs)
+
+    def by_sid(self, sid, dcs=None):
+        with self._lock:
+            keys = set((dc, sid) for dc, vms in self._vms.items() if sid in vms)
+        return self._resolve(keys, dcs)
+
+    def by_ip(self, ip, dcs=None):
+        return self._resolve(self._by_ip.get(ip, set()), dcs)
+
+    def find(self, pattern=None, dcs=None):
+        """VMs whose name contains pattern, the same match as CloudInterface.get_vm."""
+        with self._lock:
+            if pattern is None:
+                keys = [(dc, sid) for dc, vms in self._vms.items() for sid in vms]
+            else:
+                keys = [key for name, name_keys in self._by_name.items() if pattern in name for key in name_keys]
+        return self._resolve(keys, dcs)
@@ -0,0 +1,94 @@
+import collections
+import threading
+
+
+class IpPool(object):
+    """Public IPs of one datacenter purchased ahead of demand.
+
+    purchase() buys one IP. A background thread buys exactly the announced
+    demand. Only once a request came unannounced does the pool also keep
+    low_water IPs in stock, buying batch IPs at a time.
+    """
+
+    def __init__(self, purchase, release=None, low_water=2, batch=5, logger=None):
+        self.purchase = purchase
+        self.release = release
+        self.low_water = low_water
+        self.batch = batch
+        self.logger = logger
+        self.expected = 0
+        self.unannounced = False
+        self._ips = collections.deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    def __len__(self):
+        return len(self._ips)
+
+    def expect(self, count):
+        """Announce count upcoming requests so that they are bought ahead."""
+        with self._lock:
+            self.expected += count
+        self.refill()
+
+    def get(self):
+        """Return a purchased IP without blocking, None if the stock is empty."""
+        with self._lock:
+            if self.expected == 0:
+                self.unannounced = True
+            self.expected = max(0, self.expected - 1)
+            ip = self._ips.popleft() if len(self._ips) > 0 else None
+        self.refill()
+        return ip
+
+    def put(self, ip):
+        """Give back an IP that was not used."""
+        with self._lock:
+            self._ips.append(ip)
+
+    def _deficit(self):
+        if len(self._ips) < self.expected:
+            return self.expected - len(self._ips)
+        if self.unannounced is True and len(self._ips) < self.low_water:
+            return max(self.batch, self.low_water - len(self._ips))
+        return 0
+
+    def refill(self):
+        with self._lock:
+            if self._refilling or self._deficit() == 0:
+                return
+            self._refilling = True
+        t = threading.Thread(target=self._refill)
+        t.setDaemon(True)
+        t.start()
+
+    def _refill(self):
+        ok = False
+        try:
+            with self._lock:
+                count = self._deficit()
+            for _ in xrange(count):
+                ip = self.purchase()
+                with self._lock:
+                    self._ips.append(ip)
+            ok = True
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.warning('Cannot purchase public IP: %s' % e)
+        finally:
+            with self._lock:
+                self._refilling = False
+        if ok is True:
+            # demand may have grown while buying
+            self.refill()
+
+    def drain(self, release=False):
+        """Empty the pool, releasing the IPs if asked, and return them."""
+        with self._lock:
+            self.expected = 0
+            self.unannounced = False
+            ips, self._ips = list(self._ips), collections.deque()
+        if release is True and self.release is not None:
+            for ip in ips:
+                self.release(ip)
+        return ips
@@ -0,0 +1,142 @@
+import threading
+import time
+
+from pyArubaConsole.helper.Executor import Future
+
+
+class JobTracker(object):
+    """Polls the job list of one datacenter on behalf of every waiter.
+
+    get_jobs() must return the list of pending jobs. A single thread runs
+    while someone is waiting: it polls every min_interval seconds after a new
+    waiter arrives and stretches the interval by backoff on every tick, up to
+    max_interval, so long jobs cost few calls.
+    """
+
+    def __init__(self, get_jobs, min_interval=1.0, max_interval=15.0, backoff=1.5, logger=None):
+        self.get_jobs = get_jobs
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.logger = logger
+        self.polls = 0
+        self._condition = threading.Condition()
+        self._waiters = 0
+        self._watches = []
+        self._tick = 0
+        self._pending = None
+        self._interval = min_interval
+        self._reset = False
+        self._thread = None
+
+    @staticmethod
+    def _keys(job):
+        yield ('job', job.get('JobId'))
+        yield ('vm', job.get('ServerName'))
+
+    @staticmethod
+    def _key(job_or_vm):
+        if job_or_vm is None:
+            return None
+        if isinstance(job_or_vm, dict):
+            return 'job', job_or_vm.get('JobId')
+        if isinstance(job_or_vm, (int, long)):
+            return 'job', job_or_vm
+        return 'vm', job_or_vm
+
+    def _done(self, key):
+        if key is None:
+            return len(self._pending) == 0
+        return key not in self._pending
+
+    def wait(self, job_or_vm=None, timeout=None):
+        """Block until a job (a job dict, a job id or a VM name) is no longer
+        pending, or until every job is done when job_or_vm is None.
+        Return False on timeout."""
+        key = self._key(job_or_vm)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            self._waiters += 1
+            self._wake()
+            registered = self._tick
+            try:
+                while self._tick <= registered or not self._done(key):
+                    remaining = 1 if deadline is None else min(1, deadline - time.time())
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._waiters -= 1
+                self._condition.notify_all()
+        return True
+
+    def watch(self, job_or_vm=None, timeout=None):
+        """Like wait, but return at once a Future resolved with True once the
+        job is done or False on timeout, so that no thread waits meanwhile."""
+        future = Future()
+        with self._condition:
+            self._watches.append((self._key(job_or_vm), future, self._tick,
+                                  None if timeout is None else time.time() + timeout))
+            self._wake()
+        return future
+
+    def _wake(self):
+        self._interval = self.min_interval
+        self._reset = True
+        self._condition.notify_all()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def _wanted(self):
+        return self._waiters > 0 or any(not future.cancelled() for _, future, _, _ in self._watches)
+
+    def _resolve_watches(self):
+        """Remove the watches that are over, return them with their outcome."""
+        now = time.time()
+        over, watches = [], []
+        for watch in self._watches:
+            key, future, registered, deadline = watch
+            if future.cancelled():
+                continue
+            if self._tick > registered and self._done(key):
+                over.append((future, True))
+            elif deadline is not None and now >= deadline:
+                over.append((future, False))
+            else:
+                watches.append(watch)
+        self._watches = watches
+        return over
+
+    def _run(self):
+        while True:
+            try:
+                pending = set(key for job in self.get_jobs() or [] for key in self._keys(job))
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.debug('Cannot poll jobs: %s' % e)
+                pending = None
+            with self._condition:
+                self.polls += 1
+                if pending is not None:
+                    self._pending = pending
+                    self._tick += 1
+                self._condition.notify_all()
+                over = self._resolve_watches()
+            # callbacks of the watches may watch again, they run out of the lock
+            for future, done in over:
+                future.set_result(done)
+            with self._condition:
+                if not self._wanted():
+                    self._thread = None
+                    return
+                self._reset = False
+                deadline = time.time() + self._interval
+                self._interval = min(self.max_interval, self._interval * self.backoff)
+                # a new waiter sets _reset and wakes the poller up early
+                while self._wanted() and not self._reset and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                if not self._wanted():
+                    self._thread = None
+                    return
@@ -0,0 +1,124 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Histogram(object):
+    """Latency histogram with fixed bucket upper bounds, in seconds."""
+    bounds = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile."""
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+class Metrics(object):
+    """Per datacenter and method call latencies and errors, plus gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.errors = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def observe(self, dc, method, seconds, error=False):
+        key = (str(dc), method)
+        with self._lock:
+            self.latency.setdefault(key, Histogram()).observe(seconds)
+            if error is True:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    @contextmanager
+    def measure(self, dc, method):
+        started = time.time()
+        try:
+            yield
+        except Exception:
+            self.observe(dc, method, time.time() - started, error=True)
+            raise
+        self.observe(dc, method, time.time() - started)
+
+    def timed(self, dc, method, function):
+        """Wrap function so that every call is measured."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.measure(dc, method):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def add_gauge(self, name, function):
+        """Register function() returning a number, or a dict of labels to numbers."""
+        self.gauges[name] = function
+
+    def reset(self):
+        with self._lock:
+            self.latency = {}
+            self.errors = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            latency = dict((key, (h.count, h.sum, list(h.counts), h.quantile(0.5), h.quantile(0.99)))
+                           for key, h in self.latency.items())
+            errors = dict(self.errors)
+        calls = []
+        for (dc, method), (count, total, counts, p50, p99) in sorted(latency.items()):
+            calls.append({'dc': dc, 'method': method, 'count': count, 'errors': errors.get((dc, method), 0),
+                          'sum': total, 'avg': total / count if count else 0, 'p50': p50, 'p99': p99,
+                          'buckets': dict(zip([str(b) for b in Histogram.bounds], counts))})
+        gauges = {}
+        for name, function in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception:
+                pass
+        return {'since': self.started, 'calls': calls, 'gauges': gauges}
+
+    def prometheus(self, prefix='arubaconsole'):
+        """Return the snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = ['# TYPE %s_call_seconds histogram' % prefix]
+        for call in snapshot['calls']:
+            labels = 'dc="%s",method="%s"' % (call['dc'], call['method'])
+            cumulative = 0
+            for bound in Histogram.bounds:
+                cumulative += call['buckets'][str(bound)]
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append('%s_call_seconds_bucket{%s,le="%s"} %s' % (prefix, labels, le, cumulative))
+            lines.append('%s_call_seconds_sum{%s} %s' % (prefix, labels, call['sum']))
+            lines.append('%s_call_seconds_count{%s} %s' % (prefix, labels, call['count']))
+        lines.append('# TYPE %s_call_errors_total counter' % prefix)
+        for call in snapshot['calls']:
+            lines.append('%s_call_errors_total{dc="%s",method="%s"} %s' %
+                         (prefix, call['dc'], call['method'], call['errors']))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            if isinstance(value, dict):
+                for label, v in sorted(value.items()):
+                    lines.append('%s_%s{name="%s"} %s' % (prefix, name, label, v))
+            else:
+                lines.append('%s_%s %s' % (prefix, name, value))
+        return '\n'.join(lines) + '\n'
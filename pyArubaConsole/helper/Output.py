@@ -0,0 +1,69 @@
+import csv
+import json
+import sys
+
+
+class RowWriter(object):
+    """Render result rows one at a time as a text table, JSON Lines or CSV.
+
+    columns is a list of (name, width) pairs, selected an optional list of
+    column names to keep. With page_size the text output pauses every
+    page_size rows when stdin is a terminal.
+    """
+    formats = ('text', 'jsonl', 'csv')
+
+    def __init__(self, columns, fmt='text', selected=None, page_size=0, stream=None):
+        if fmt not in self.formats:
+            raise ValueError('Unknown output format: %s' % fmt)
+        if selected is not None:
+            widths = dict(columns)
+            unknown = [name for name in selected if name not in widths]
+            if len(unknown) > 0:
+                raise ValueError('Unknown column(s): %s. Available: %s' %
+                                 (', '.join(unknown), ', '.join(name for name, _ in columns)))
+            columns = [(name, widths[name]) for name in selected]
+        self.columns = columns
+        self.fmt = fmt
+        self.page_size = page_size
+        self.stream = stream or sys.stdout
+        self.rows = 0
+        self.stopped = False
+        self._csv = csv.writer(self.stream) if fmt == 'csv' else None
+
+    @staticmethod
+    def _text(value):
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    def _line(self, values):
+        return ' '.join('%-*s' % (width, value) for (_, width), value in zip(self.columns, values)).rstrip()
+
+    def write(self, row):
+        """Render one row, return False once the reader asked to stop."""
+        if self.stopped is True:
+            return False
+        values = [row.get(name) for name, _ in self.columns]
+        if self.fmt == 'jsonl':
+            self.stream.write(json.dumps(dict((name, row.get(name)) for name, _ in self.columns)) + '\n')
+        elif self.fmt == 'csv':
+            if self.rows == 0:
+                self._csv.writerow([name for name, _ in self.columns])
+            self._csv.writerow([self._text(v) for v in values])
+        else:
+            if self.rows == 0:
+                self.stream.write(self._line([name.upper() for name, _ in self.columns]) + '\n')
+            self.stream.write(self._line([self._text(v) for v in values]) + '\n')
+        self.stream.flush()
+        self.rows += 1
+        if self.fmt == 'text' and self.page_size > 0 and self.rows % self.page_size == 0 and sys.stdin.isatty():
+            if raw_input('-- More -- (Enter: next page, q: quit) ').strip().lower() == 'q':
+                self.stopped = True
+        return not self.stopped
+
+    def write_all(self, rows):
+        for row in rows:
+            if self.write(row) is False:
+                break
@@ -0,0 +1,122 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Rate limiter allowing rate calls per second with bursts of burst calls.
+
+    A rate of 0 or less disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take tokens from the bucket, sleeping until they are available."""
+        while self.rate > 0:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class NameRegistry(object):
+    """Reservations of VM names per datacenter.
+
+    exists(dc, name) tells whether a VM already owns a name outside of the
+    registry. The reservation of a created VM is kept until exists() reports
+    the VM, from then on exists() alone protects the name.
+    """
+
+    def __init__(self, exists=None):
+        self.exists = exists
+        self._names = set()
+        self._created = set()
+        self._lock = threading.Lock()
+
+    def reserve(self, dc, name):
+        with self._lock:
+            exists = self.exists is not None and self.exists(dc, name)
+            if exists and (dc, name) in self._created:
+                self._created.discard((dc, name))
+                self._names.discard((dc, name))
+            if (dc, name) in self._names or exists:
+                return False
+            self._names.add((dc, name))
+            return True
+
+    def created(self, dc, name):
+        """Keep the reservation of name until its VM is reported by exists()."""
+        with self._lock:
+            if (dc, name) in self._names:
+                self._created.add((dc, name))
+
+    def release(self, dc, name):
+        with self._lock:
+            self._names.discard((dc, name))
+            self._created.discard((dc, name))
+
+
+class Progress(object):
+    """Counters of a provisioning run."""
+
+    def __init__(self):
+        self.submitted = 0
+        self.in_flight = 0
+        self.done = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    def submit(self, count=1):
+        with self._lock:
+            if self.submitted == self.done + self.failed + self.cancelled:
+                # a new run starts once the previous one is drained
+                self.submitted = self.done = self.failed = self.cancelled = 0
+                self.started = time.time()
+            self.submitted += count
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def cancel(self, count=1):
+        """Count submitted items cancelled before they started."""
+        with self._lock:
+            self.cancelled += count
+
+    def cancel_queued(self):
+        """Count the submitted items that never started as cancelled."""
+        with self._lock:
+            self.cancelled = self.submitted - self.in_flight - self.done - self.failed
+
+    def finish(self, ok):
+        """Count an item that started as done, failed or, with ok None, cancelled."""
+        with self._lock:
+            self.in_flight -= 1
+            if ok is True:
+                self.done += 1
+            elif ok is None:
+                self.cancelled += 1
+            else:
+                self.failed += 1
+
+    def summary(self):
+        elapsed = time.time() - self.started if self.started is not None else 0
+        throughput = self.done * 60.0 / elapsed if elapsed > 0 else 0
+        queued = self.submitted - self.in_flight - self.done - self.failed - self.cancelled
+        line = 'submitted: %s in flight: %s queued: %s done: %s failed: %s' % (
+            self.submitted, self.in_flight, queued, self.done, self.failed)
+        if self.cancelled > 0:
+            line += ' cancelled: %s' % self.cancelled
+        return line + ' elapsed: %.0fs throughput: %.2f VM/min' % (elapsed, throughput)
@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+
+
+class CircuitBreaker(object):
+    """Consecutive failure counter of one backend.
+
+    After threshold failures in a row the circuit opens and allow() refuses
+    calls for cooldown seconds. Then a single trial call is let through every
+    cooldown seconds until one succeeds and closes the circuit again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=3, cooldown=60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.time() - self.opened_at >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_in(self):
+        """Seconds before the next call is let through, 0 when the circuit lets calls through now."""
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.cooldown - time.time())
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.cooldown:
+                # the trial call gets a whole cooldown to report back
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+    def reset(self):
+        self.success()
+
+
+def backoff(attempt, base=0.5, cap=8.0):
+    """Delay before retry number attempt (0 based): full jitter over an exponential range."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retries(function, args=(), kwargs=None, retries=2, deadline=None, transient=(IOError,),
+                      base=0.5, cap=8.0, logger=None):
+    """Call function, retrying up to retries times on transient exceptions.
+
+    Retries sleep a jittered exponential backoff and are not attempted when
+    they could not start before deadline (a time.time() value). The last
+    exception is raised once the retries are exhausted.
+    """
+    kwargs = kwargs or {}
+    attempt = 0
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except transient as e:
+            delay = backoff(attempt, base, cap)
+            if attempt >= retries or (deadline is not None and time.time() + delay >= deadline):
+                raise
+            if logger is not None:
+                logger.debug('Retrying %s in %.2fs after: %s' % (getattr(function, '__name__', function), delay, e))
+            attempt += 1
+            time.sleep(delay)
@@ -0,0 +1,93 @@
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import time
+
+
+class SessionCache(object):
+    """On-disk cache of the resources loaded by a datacenter login.
+
+    Entries are keyed by username and datacenter and expire after ttl seconds.
+    Credentials are never written: the auth object is stored as a reference
+    and replaced on restore, and an entry is only reused when the digest of
+    the supplied credentials matches the one it was stored with. The digest
+    is a salted PBKDF2 of the credentials, the salt being drawn per entry. It
+    is kept in a JSON header line, so nothing is unpickled before it matches.
+    """
+    iterations = 100000
+    resources = ('vmlist', 'iplist', 'templates', 'hypervisors', 'json_templates', 'json_servers', 'ip_resource')
+
+    def __init__(self, path=None, ttl=3600):
+        self.path = path or os.path.join(os.path.expanduser('~'), '.pyArubaConsole', 'sessions')
+        self.ttl = ttl
+
+    def _filename(self, username, dc):
+        return os.path.join(self.path, hashlib.sha256('%s|%s' % (username, dc)).hexdigest())
+
+    @classmethod
+    def _digest(cls, username, password, dc, salt):
+        return hashlib.pbkdf2_hmac('sha256', '%s|%s|%s' % (username, password, dc), salt, cls.iterations)
+
+    @staticmethod
+    def _shared(interface):
+        shared = {'interface': interface}
+        for name in ('auth', 'logger'):
+            if getattr(interface, name, None) is not None:
+                shared[name] = getattr(interface, name)
+        return shared
+
+    def store(self, interface, username, password, dc):
+        shared = self._shared(interface)
+        ids = dict((id(obj), name) for name, obj in shared.items())
+        state = dict((name, getattr(interface, name)) for name in self.resources if hasattr(interface, name))
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, 0700)
+        filename = self._filename(username, dc)
+        tmp = '%s.%s.tmp' % (filename, os.getpid())
+        salt = os.urandom(16)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                digest = self._digest(username, password, dc, salt)
+                json.dump({'salt': salt.encode('hex'), 'digest': digest.encode('hex'),
+                           'expires': time.time() + self.ttl}, stream)
+                stream.write('\n')
+                pickler = pickle.Pickler(stream, pickle.HIGHEST_PROTOCOL)
+                pickler.persistent_id = lambda obj: ids.get(id(obj))
+                pickler.dump(state)
+            os.rename(tmp, filename)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def restore(self, interface, username, password, dc):
+        """Load a valid cached entry into interface, return True on a hit."""
+        filename = self._filename(username, dc)
+        if not os.path.isfile(filename):
+            return False
+        shared = self._shared(interface)
+        with open(filename, 'rb') as stream:
+            try:
+                meta = json.loads(stream.readline())
+                salt, digest = meta['salt'].decode('hex'), meta['digest'].decode('hex')
+            except (ValueError, TypeError, KeyError):
+                # an entry written in an older format
+                return False
+            if meta['expires'] < time.time():
+                return False
+            if not hmac.compare_digest(digest, self._digest(username, password, dc, salt)):
+                return False
+            unpickler = pickle.Unpickler(stream)
+            unpickler.persistent_load = shared.__getitem__
+            state = unpickler.load()
+        for name, value in state.items():
+            setattr(interface, name, value)
+        return True
+
+    def invalidate(self, username, dc):
+        filename = self._filename(username, dc)
+        if os.path.isfile(filename):
+            os.remove(filename)
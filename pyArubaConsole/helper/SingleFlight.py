@@ -0,0 +1,72 @@
+import functools
+import sys
+import threading
+import time
+
+from pyArubaConsole.helper.Executor import Future
+
+
+class SingleFlight(object):
+    """Wrap function so that identical concurrent calls share one call.
+
+    Calls with the same arguments made while one is in flight wait for it and
+    get its result (or its exception). With ttl > 0 a result is also reused
+    for ttl seconds after the call returns.
+    """
+
+    def __init__(self, function, ttl=0):
+        self.function = function
+        self.ttl = ttl
+        self.calls = 0
+        self.shared = 0
+        self.cached = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._results = {}
+        functools.update_wrapper(self, function)
+
+    @staticmethod
+    def _key(args, kwargs):
+        return args, tuple(sorted(kwargs.items()))
+
+    def invalidate(self):
+        """Forget the cached results, calls in flight are not affected."""
+        with self._lock:
+            self._results.clear()
+
+    def __call__(self, *args, **kwargs):
+        key = self._key(args, kwargs)
+        with self._lock:
+            if self.ttl > 0 and key in self._results:
+                stored, result = self._results[key]
+                if time.time() - stored < self.ttl:
+                    self.cached += 1
+                    return result
+                del self._results[key]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader is True:
+                future = self._in_flight[key] = Future()
+                future.set_running_or_notify_cancel()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if leader is False:
+            return future.result()
+        try:
+            result = self.function(*args, **kwargs)
+        except Exception:
+            exc_info = sys.exc_info()
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        with self._lock:
+            del self._in_flight[key]
+            if self.ttl > 0:
+                self._results[key] = (time.time(), result)
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        return {'calls': self.calls, 'shared': self.shared, 'cached': self.cached}
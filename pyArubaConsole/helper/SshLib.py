@@ -1,7 +1,72 @@
+import errno
+import hashlib
+import heapq
+import itertools
 import paramiko
 import os
+import pipes
+import select
+import socket
+import threading
+import time
 from scp import SCPClient
 
+from pyArubaConsole.helper.Executor import Future, WorkerPool, chain
+from pyArubaConsole.helper.Resilience import backoff
+
+
+class CommandStream(object):
+    """Iterator over the ('stdout' or 'stderr', line) pairs of a remote
+    command, read as they arrive. exit_status is set once it is exhausted.
+    """
+
+    def __init__(self, channel, timeout=None, bufsize=32768):
+        self.channel = channel
+        self.timeout = timeout
+        self.bufsize = bufsize
+        self.exit_status = None
+
+    def __iter__(self):
+        readers = (('stdout', self.channel.recv_ready, self.channel.recv),
+                   ('stderr', self.channel.recv_stderr_ready, self.channel.recv_stderr))
+        try:
+            buffers = {'stdout': '', 'stderr': ''}
+            while True:
+                received = False
+                for name, ready, recv in readers:
+                    if not ready():
+                        continue
+                    data = recv(self.bufsize)
+                    received = received or len(data) > 0
+                    lines = (buffers[name] + data).split('\n')
+                    buffers[name] = lines.pop()
+                    for line in lines:
+                        yield name, line
+                if received:
+                    continue
+                if self.channel.exit_status_ready() or self.channel.closed:
+                    if not self.channel.recv_ready() and not self.channel.recv_stderr_ready():
+                        break
+                    continue
+                if len(select.select([self.channel], [], [], self.timeout)[0]) == 0:
+                    raise socket.timeout('No output for %s seconds.' % self.timeout)
+            for name, _, _ in readers:
+                if buffers[name] != '':
+                    yield name, buffers[name]
+            self.exit_status = self.channel.recv_exit_status()
+        finally:
+            # also on timeout or when the caller stops reading
+            self.channel.close()
+
+
+def file_md5(path, chunk_size=1024 * 1024):
+    """Return the md5 hex digest of a local file, read in chunks."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(chunk_size), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
 class Ssh(object):
     _hostname = None
@@ -24,6 +89,10 @@ class Ssh(object):
     def password(self):
         return self._password
 
+    @property
+    def transport(self):
+        return self.__ssh.get_transport()
+
     @hostname.setter
     def hostname(self, value):
         self._hostname = value
@@ -39,20 +108,55 @@ class Ssh(object):
     def __enter__(self):
         return self
 
-    def connect(self):
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self, timeout=None):
+        """Connect and authenticate, raising on failure."""
         if self.hostname is None:
-            raise 'Error, no hostname has been defined.'
+            raise ValueError('Error, no hostname has been defined.')
+        self.__ssh.connect(self.hostname, username=self.username, password=self.password, timeout=timeout)
+
+    def connect(self, timeout=None):
         try:
-            self.__ssh.connect(self.hostname, username=self.username, password=self.password)
+            self.open(timeout)
         except Exception as exc:
             print {'status': 'ERR', 'error': exc}
+            return False
+        return True
 
-    def run_command(self, cmd):
+    def is_active(self):
+        return self.transport is not None and self.transport.is_active()
+
+    def close(self):
+        self.__ssh.close()
+
+    def stream_command(self, cmd, timeout=None):
+        """Start cmd and return a CommandStream over its output."""
+        channel = self.transport.open_session()
+        channel.settimeout(timeout)
+        channel.exec_command(cmd)
+        return CommandStream(channel, timeout)
+
+    def run_command(self, cmd, timeout=None, callback=None):
+        """Run cmd. Output lines are passed to callback(stream, line) as they
+        arrive when a callback is given, otherwise they are collected."""
+        output = {'stdout': [], 'stderr': []}
         try:
-            stdin, stdout, stderr = self.__ssh.exec_command(cmd)
+            stream = self.stream_command(cmd, timeout)
+            for name, line in stream:
+                if callback is not None:
+                    callback(name, line)
+                elif line != '':
+                    output[name].append(line)
+        except socket.timeout:
+            return {'status': 'TIMEOUT'}
         except:
             return {'status': 'KO'}
-        return {'status': 'OK', 'stdout': filter(None, stdout.read().split('\n'))}
+        if callback is not None:
+            return {'status': 'OK', 'exit_status': stream.exit_status}
+        return {'status': 'OK', 'stdout': output['stdout'], 'stderr': output['stderr'],
+                'exit_status': stream.exit_status}
 
     def put_file(self, source, destination):
         assert os.path.isfile(source)
@@ -63,3 +167,425 @@ class Ssh(object):
             print err
             return {'status': 'KO'}
         return {'status': 'OK'}
+
+    def remote_file(self, path, timeout=None):
+        """Return (size, md5) of a remote file, None if it does not exist."""
+        quoted = pipes.quote(path)
+        result = self.run_command('test -f %s && stat -c %%s %s && md5sum %s' % (quoted, quoted, quoted), timeout)
+        if result['status'] != 'OK' or result['exit_status'] != 0 or len(result['stdout']) < 2:
+            return None
+        return int(result['stdout'][0]), result['stdout'][1].split()[0]
+
+    def sync_file(self, source, destination, md5=None, timeout=None):
+        """Copy source to destination unless an identical file is already there."""
+        size = os.path.getsize(source)
+        if self.remote_file(destination, timeout) == (size, md5 or file_md5(source)):
+            return {'status': 'SKIPPED', 'bytes': 0}
+        # SCPClient streams the file in chunks
+        result = self.put_file(source, destination)
+        result['bytes'] = size if result['status'] == 'OK' else 0
+        return result
+
+
+class SshPool(object):
+    """Authenticated SSH connections kept alive and reused across commands.
+
+    get() hands out a connection and release() gives it back. Connections
+    nobody uses are closed once idle for idle_timeout seconds, or oldest
+    first when more than max_connections are open.
+    """
+
+    def __init__(self, username=None, password=None, timeout=10, keepalive=30, max_connections=256,
+                 idle_timeout=300):
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._connections = {}
+        self._users = {}
+        self._last_used = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _host_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _use(self, key, ssh):
+        with self._lock:
+            if ssh is None:
+                ssh = self._connections.get(key)
+                if ssh is None or not ssh.is_active():
+                    return None
+            self._connections[key] = ssh
+            self._users[key] = self._users.get(key, 0) + 1
+            self._last_used[key] = time.time()
+            return ssh
+
+    def get(self, hostname, username=None, password=None):
+        """Return a connected Ssh for hostname, opening it only if needed. Give it back with release()."""
+        key = (hostname, username or self.username)
+        with self._host_lock(key):
+            ssh = self._use(key, None)
+            if ssh is None:
+                ssh = Ssh()
+                ssh.hostname = hostname
+                ssh.username = username or self.username
+                ssh.password = password or self.password
+                ssh.open(self.timeout)
+                ssh.transport.set_keepalive(self.keepalive)
+                self._use(key, ssh)
+        self.evict()
+        return ssh
+
+    def release(self, hostname, username=None):
+        key = (hostname, username or self.username)
+        with self._lock:
+            if self._users.get(key, 0) > 0:
+                self._users[key] -= 1
+                self._last_used[key] = time.time()
+        self.evict()
+
+    def evict(self):
+        """Close the unused connections idle for too long or beyond max_connections, oldest first."""
+        now = time.time()
+        evicted = []
+        with self._lock:
+            excess = len(self._connections) - self.max_connections
+            for last_used, key in sorted((self._last_used.get(key, 0), key) for key in self._connections
+                                         if self._users.get(key, 0) == 0):
+                if excess <= 0 and now - last_used < self.idle_timeout:
+                    break
+                evicted.append(self._pop(key))
+                excess -= 1
+        for ssh in evicted:
+            ssh.close()
+        return len(evicted)
+
+    def _pop(self, key):
+        self._users.pop(key, None)
+        self._last_used.pop(key, None)
+        return self._connections.pop(key, None)
+
+    def discard(self, hostname, username=None):
+        with self._lock:
+            ssh = self._pop((hostname, username or self.username))
+        if ssh is not None:
+            ssh.close()
+
+    def close(self):
+        for key in self._connections.keys():
+            self.discard(*key)
+
+    def run(self, hostname, cmd, timeout=None, callback=None):
+        """Run cmd on hostname, return a result dict that never raises."""
+        started = time.time()
+        try:
+            ssh = self.get(hostname)
+            try:
+                result = ssh.run_command(cmd, timeout=timeout, callback=callback)
+            finally:
+                self.release(hostname)
+            if result['status'] == 'TIMEOUT':
+                # the connection may be wedged, do not hand it out again
+                self.discard(hostname)
+        except socket.timeout:
+            self.discard(hostname)
+            result = {'status': 'TIMEOUT'}
+        except Exception as exc:
+            self.discard(hostname)
+            result = {'status': 'KO', 'error': str(exc)}
+        result['host'] = hostname
+        result['elapsed'] = time.time() - started
+        return result
+
+    def map(self, function, hosts, parallelism=20):
+        """Call function(host) on every host with at most parallelism threads,
+        return the results keyed by host."""
+        hosts = list(hosts)
+        with WorkerPool(min(parallelism, len(hosts))) as workers:
+            futures = [(host, workers.submit(function, host)) for host in hosts]
+            return dict((host, future.result()) for host, future in futures)
+
+    def fan_out(self, hosts, cmd, parallelism=20, timeout=60, callback=None):
+        """Run cmd on every host concurrently, return the results keyed by host.
+        callback(host, stream, line) receives the output as it arrives."""
+        def run(host):
+            line_callback = None
+            if callback is not None:
+                line_callback = lambda name, line: callback(host, name, line)
+            return self.run(host, cmd, timeout, line_callback)
+        return self.map(run, hosts, parallelism)
+
+    def distribute(self, hosts, files, parallelism=20, timeout=60):
+        """Copy (source, destination) files to every host concurrently, skipping
+        identical ones. Return the results keyed by host and a summary dict."""
+        checksums = dict((source, file_md5(source)) for source, _ in files)
+
+        def sync(host):
+            started = time.time()
+            result = {'host': host, 'status': 'OK', 'files': {}, 'bytes': 0}
+            try:
+                ssh = self.get(host)
+                try:
+                    for source, destination in files:
+                        status = ssh.sync_file(source, destination, checksums[source], timeout)
+                        result['files'][destination] = status['status']
+                        result['bytes'] += status.get('bytes', 0)
+                        if status['status'] == 'KO':
+                            result['status'] = 'KO'
+                finally:
+                    self.release(host)
+            except Exception as exc:
+                self.discard(host)
+                result.update({'status': 'KO', 'error': str(exc)})
+            result['elapsed'] = time.time() - started
+            return result
+
+        started = time.time()
+        results = self.map(sync, hosts, parallelism)
+        elapsed = time.time() - started
+        statuses = [status for result in results.values() for status in result['files'].values()]
+        sent = sum(result['bytes'] for result in results.values())
+        summary = {'hosts': len(results),
+                   'failed_hosts': len([r for r in results.values() if r['status'] != 'OK']),
+                   'sent': statuses.count('OK'),
+                   'skipped': statuses.count('SKIPPED'),
+                   'bytes': sent,
+                   'elapsed': elapsed,
+                   'throughput': sent / elapsed if elapsed > 0 else 0}
+        return results, summary
+
+
+class PortWatcher(object):
+    """Waits for many hosts to answer on a TCP port, from a single thread.
+
+    Connections are non blocking and multiplexed with select. A host is up
+    once it accepts a connection and sends a line starting with banner, the
+    SSH identification string by default. Refused, reset or silent
+    connections are retried every interval seconds. At most max_sockets
+    connections are open at once.
+    """
+
+    def __init__(self, port=22, banner='SSH-', interval=2.0, connect_timeout=5.0, max_sockets=512):
+        self.port = port
+        self.banner = banner
+        self.interval = interval
+        self.connect_timeout = connect_timeout
+        self.max_sockets = max_sockets
+        self._lock = threading.Lock()
+        self._due = []
+        self._sequence = itertools.count()
+        self._sockets = {}
+        self._wakeup = os.pipe()
+        self._thread = None
+
+    def watch(self, host, timeout=600):
+        """Return a Future resolved with True once host is up, False after timeout seconds."""
+        future = Future()
+        now = time.time()
+        with self._lock:
+            heapq.heappush(self._due, (now, next(self._sequence), host, future, now + timeout))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        os.write(self._wakeup[1], 'x')
+        return future
+
+    def _retry(self, host, future, deadline):
+        if time.time() + self.interval >= deadline:
+            future.set_result(False)
+            return
+        with self._lock:
+            heapq.heappush(self._due, (time.time() + self.interval, next(self._sequence), host, future, deadline))
+
+    def _connect(self, host, future, deadline):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        try:
+            error = sock.connect_ex((host, self.port))
+        except socket.error:
+            error = errno.EHOSTUNREACH
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            sock.close()
+            self._retry(host, future, deadline)
+            return
+        self._sockets[sock] = {'host': host, 'future': future, 'deadline': deadline, 'started': time.time(),
+                               'connected': False, 'data': ''}
+
+    def _close(self, sock, up=None):
+        state = self._sockets.pop(sock)
+        sock.close()
+        if up is True:
+            state['future'].set_result(True)
+        else:
+            self._retry(state['host'], state['future'], state['deadline'])
+
+    def _start_due(self):
+        """Open the connections due, return the seconds until the next one is due."""
+        while True:
+            with self._lock:
+                if len(self._due) == 0:
+                    return None
+                if self._due[0][0] > time.time() or len(self._sockets) >= self.max_sockets:
+                    return max(0, self._due[0][0] - time.time())
+                _, _, host, future, deadline = heapq.heappop(self._due)
+            if not future.cancelled():
+                self._connect(host, future, deadline)
+
+    def _read(self, sock):
+        state = self._sockets[sock]
+        try:
+            data = sock.recv(256)
+        except socket.error:
+            data = ''
+        state['data'] += data
+        if data == '':
+            self._close(sock)
+        elif state['data'].startswith(self.banner):
+            self._close(sock, up=True)
+        elif len(state['data']) >= len(self.banner):
+            self._close(sock)
+
+    def _run(self):
+        while True:
+            next_due = self._start_due()
+            with self._lock:
+                if len(self._sockets) == 0 and next_due is None:
+                    self._thread = None
+                    return
+            connecting = [sock for sock, state in self._sockets.items() if state['connected'] is False]
+            reading = [sock for sock, state in self._sockets.items() if state['connected'] is True]
+            wait = min(0.5, next_due) if next_due is not None else 0.5
+            readable, writable, _ = select.select(reading + [self._wakeup[0]], connecting, [], wait)
+            if self._wakeup[0] in readable:
+                os.read(self._wakeup[0], 4096)
+                readable.remove(self._wakeup[0])
+            for sock in writable:
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                    self._close(sock)
+                else:
+                    self._sockets[sock]['connected'] = True
+            for sock in readable:
+                if sock in self._sockets:
+                    self._read(sock)
+            now = time.time()
+            for sock, state in self._sockets.items():
+                if state['future'].cancelled() or now - state['started'] > self.connect_timeout:
+                    self._close(sock)
+
+
+class ReadinessProbe(object):
+    """Waits for freshly created hosts to accept SSH logins, then bootstraps them.
+
+    A PortWatcher thread waits for the SSH port of every host to answer, so
+    hosts still booting hold no thread. Then at most parallelism hosts log
+    in at once. Failed logins are retried
+    after a jittered exponential backoff between base and cap seconds until
+    timeout seconds have passed. The time from since (the end of the
+    creation) to the first successful login is kept for every ready host.
+    The probe owns its login threads, close() stops them.
+    """
+
+    def __init__(self, pool, parallelism=20, timeout=600, base=2.0, cap=30.0, port=22, logger=None):
+        self.pool = pool
+        self.ports = PortWatcher(port)
+        self.timeout = timeout
+        self.base = base
+        self.cap = cap
+        self.logger = logger
+        self.ready_after = []
+        self.failed = 0
+        self.pending = 0
+        self._lock = threading.Condition()
+        self._workers = WorkerPool(parallelism, logger).start()
+        self.closed = False
+
+    def submit(self, host, username, password, since=None, bootstrap=None, files=(), timeout=None):
+        """Queue the probe of host, return a Future of its result dict."""
+        if self.closed is True:
+            raise RuntimeError('The readiness probe is closed.')
+        since = since or time.time()
+        timeout = timeout or self.timeout
+        with self._lock:
+            self.pending += 1
+        port_open = self.ports.watch(host, max(0, since + timeout - time.time()))
+        future = chain(port_open, self._workers.queue, self.probe, host, username, password, since, bootstrap,
+                       files, timeout)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            self._lock.notify_all()
+
+    def _timed_out(self, result, since, error):
+        result.update({'status': 'TIMEOUT', 'error': error, 'elapsed': time.time() - since})
+        with self._lock:
+            self.failed += 1
+        return result
+
+    def probe(self, port_open, host, username, password, since, bootstrap=None, files=(), timeout=600):
+        deadline = since + timeout
+        result = {'host': host, 'status': 'READY', 'attempts': 0}
+        if port_open is False:
+            return self._timed_out(result, since, 'port %s closed' % self.ports.port)
+        while True:
+            result['attempts'] += 1
+            try:
+                ssh = self.pool.get(host, username, password)
+                break
+            except Exception as exc:
+                delay = backoff(result['attempts'] - 1, self.base, self.cap)
+                if time.time() + delay >= deadline:
+                    return self._timed_out(result, since, str(exc))
+                if self.logger is not None:
+                    self.logger.debug('%s not ready, next probe in %.1fs: %s' % (host, delay, exc))
+                time.sleep(delay)
+        result['ready_after'] = time.time() - since
+        with self._lock:
+            self.ready_after.append(result['ready_after'])
+        try:
+            for source, destination in files:
+                status = ssh.sync_file(source, destination)
+                result.setdefault('files', {})[destination] = status['status']
+                if status['status'] == 'KO':
+                    result['status'] = 'KO'
+            if bootstrap is not None:
+                command = ssh.run_command(bootstrap, timeout=max(1, deadline - time.time()))
+                result['bootstrap'] = command
+                if command['status'] != 'OK' or command.get('exit_status') != 0:
+                    result['status'] = 'KO'
+        except Exception as exc:
+            result.update({'status': 'KO', 'error': str(exc)})
+        finally:
+            # a new host is bootstrapped once, its connection is not reused
+            self.pool.discard(host, username)
+        result['elapsed'] = time.time() - since
+        return result
+
+    def join(self):
+        """Block until every submitted probe is done."""
+        with self._lock:
+            while self.pending > 0:
+                # a finite wait keeps the calling thread responsive to Ctrl-C
+                self._lock.wait(1)
+
+    def close(self, timeout=None):
+        """Stop the login threads once the queued probes are done, waiting up to timeout seconds if given."""
+        if self.closed is False:
+            self.closed = True
+            self._workers.stop(timeout)
+
+    def summary(self):
+        with self._lock:
+            times = sorted(self.ready_after)
+            failed = self.failed
+        if len(times) == 0:
+            return 'ready: 0 not ready: %s' % failed
+        return 'ready: %s not ready: %s time to ready min: %.1fs p50: %.1fs max: %.1fs' % (
+            len(times), failed, times[0], times[len(times) // 2], times[-1])
@@ -0,0 +1,116 @@
+import bisect
+import difflib
+import json
+import os
+import threading
+import time
+
+
+def template_to_dict(template):
+    """Return the catalog entry of a CloudInterface template object."""
+    return {'id': str(getattr(template, 'template_id', getattr(template, 'id', ''))),
+            'name': getattr(template, 'name', '') or '',
+            'description': getattr(template, 'descr', '') or '',
+            'hypervisor': str(getattr(template, 'hypervisor', '')),
+            'enabled': getattr(template, 'enabled', True)}
+
+
+class TemplateCatalog(object):
+    """Templates of one datacenter, kept on disk and indexed in memory.
+
+    fetch() returns the template entries from the API. A catalog older than
+    ttl seconds is still used while a background refresh runs.
+    """
+
+    def __init__(self, key, fetch, path=None, ttl=86400):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.filename = os.path.join(path or os.path.join(os.path.expanduser('~'), '.pyArubaConsole', 'templates'),
+                                     '%s.json' % key)
+        self.fetched = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._by_id = {}
+        self._names = []
+
+    def _index(self, templates, fetched):
+        by_id = dict((t['id'], t) for t in templates)
+        names = sorted((t['name'].lower(), t['id']) for t in templates)
+        with self._lock:
+            self._by_id, self._names, self.fetched = by_id, names, fetched
+
+    def _read(self):
+        if not os.path.isfile(self.filename):
+            return False
+        with open(self.filename) as stream:
+            data = json.load(stream)
+        self._index(data['templates'], data['fetched'])
+        return True
+
+    def _write(self, templates, fetched):
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(tmp, 'w') as stream:
+            json.dump({'fetched': fetched, 'templates': templates}, stream)
+        os.rename(tmp, self.filename)
+
+    def refresh(self):
+        try:
+            templates = self.fetch()
+            fetched = time.time()
+            self._index(templates, fetched)
+            self._write(templates, fetched)
+        finally:
+            self._refreshing = False
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        t = threading.Thread(target=self.refresh)
+        t.setDaemon(True)
+        t.start()
+
+    def stale(self):
+        return self.fetched is None or time.time() - self.fetched > self.ttl
+
+    def load(self, refresh=False):
+        """Make the catalog usable: memory, then disk, then the API."""
+        if refresh is True or (self.fetched is None and not self._read()):
+            self.refresh()
+        elif self.stale():
+            self.refresh_in_background()
+        return self
+
+    def templates(self):
+        return self._by_id.values()
+
+    def get(self, template_id):
+        return self._by_id.get(str(template_id))
+
+    def find(self, query, hypervisor=None):
+        """Templates matching query by id, name prefix, then name or description
+        substring, falling back to the closest names."""
+        query = str(query)
+        lowered = query.lower()
+        with self._lock:
+            by_id, names = self._by_id, self._names
+        ids = [query] if query in by_id else []
+        i = bisect.bisect_left(names, (lowered, ''))
+        while i < len(names) and names[i][0].startswith(lowered):
+            ids.append(names[i][1])
+            i += 1
+        for t in by_id.values():
+            if lowered in t['name'].lower() or lowered in t['description'].lower():
+                ids.append(t['id'])
+        if len(ids) == 0:
+            close = difflib.get_close_matches(lowered, [name for name, _ in names], n=5, cutoff=0.6)
+            ids = [tid for name, tid in names if name in close]
+        found = []
+        for tid in ids:
+            if by_id[tid] not in found and (hypervisor is None or by_id[tid]['hypervisor'] == str(hypervisor)):
+                found.append(by_id[tid])
+        return found
@@ -0,0 +1,64 @@
+class Watcher(object):
+    """Diffs successive listings of VMs, keyed by datacenter and server id.
+
+    Rows are dicts holding at least dc and sid. The previous snapshot only
+    keeps a tuple of the watched fields per VM. The poll interval starts at
+    min_interval, stretches by backoff after every poll without changes up to
+    max_interval and drops back to min_interval on a change.
+    """
+
+    def __init__(self, fields, min_interval=5.0, max_interval=60.0, backoff=1.5):
+        self.fields = tuple(fields)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.snapshot = None
+
+    def state(self, row):
+        return tuple(row.get(field) for field in self.fields)
+
+    def update(self, rows, dcs):
+        """Replace the snapshot of the datacenters in dcs with rows, return the list of changes.
+
+        The first update only records the snapshot. Datacenters missing from
+        dcs, e.g. because they did not answer, keep their previous snapshot.
+        """
+        current = dict((dc, {}) for dc in dcs)
+        for row in rows:
+            current.setdefault(row['dc'], {})[row['sid']] = self.state(row)
+        first = self.snapshot is None
+        previous = self.snapshot or {}
+        changes = []
+        for dc in sorted(current):
+            old, new = previous.get(dc, {}), current[dc]
+            for sid in sorted(set(old) | set(new)):
+                if sid not in old:
+                    changes.append(self._change('added', dc, sid, None, new[sid]))
+                elif sid not in new:
+                    changes.append(self._change('removed', dc, sid, old[sid], None))
+                elif old[sid] != new[sid]:
+                    changes.append(self._change('changed', dc, sid, old[sid], new[sid]))
+        self.snapshot = previous
+        self.snapshot.update(current)
+        if first is True:
+            return []
+        if len(changes) > 0:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return changes
+
+    def _change(self, change, dc, sid, old, new):
+        fields = {}
+        for i, field in enumerate(self.fields):
+            before = old[i] if old is not None else None
+            after = new[i] if new is not None else None
+            if before != after:
+                fields[field] = [before, after]
+        name = (new or old)[self.fields.index('name')] if 'name' in self.fields else None
+        return {'change': change, 'dc': dc, 'sid': sid, 'name': name, 'fields': fields}
+
+    def size(self):
+        """Number of VMs in the snapshot."""
+        return sum(len(vms) for vms in (self.snapshot or {}).values())
@@ -0,0 +1,290 @@
+import Queue
+import threading
+import time
+import unittest
+
+from pyArubaConsole.helper.Executor import (CancelledError, CancelScope, Future, QueueWorker, TimeoutError, Window,
+                                            WorkerPool, as_completed, chain, enqueue, join, wait)
+
+
+def start_workers(queue, count=2):
+    workers = [QueueWorker(queue) for _ in xrange(count)]
+    for worker in workers:
+        worker.setDaemon(True)
+        worker.start()
+    return workers
+
+
+def stop_workers(queue, workers):
+    for _ in workers:
+        queue.put(None)
+    for worker in workers:
+        worker.join(5)
+
+
+class ExecutorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = Queue.Queue()
+        self.workers = start_workers(self.queue)
+
+    def tearDown(self):
+        stop_workers(self.queue, self.workers)
+
+
+class TestFuture(unittest.TestCase):
+
+    def test_result(self):
+        future = Future()
+        future.set_result(42)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 42)
+
+    def test_result_timeout(self):
+        self.assertRaises(TimeoutError, Future().result, 0.05)
+
+    def test_cancel_pending(self):
+        future = Future()
+        self.assertTrue(future.cancel())
+        self.assertTrue(future.cancelled())
+        self.assertRaises(CancelledError, future.result)
+        self.assertFalse(future.set_running_or_notify_cancel())
+
+    def test_cancel_running_fails(self):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.assertFalse(future.cancel())
+
+    def test_cancelled_future_ignores_result(self):
+        future = Future()
+        future.cancel()
+        future.set_result(1)
+        self.assertTrue(future.cancelled())
+
+    def test_callback_after_done(self):
+        future = Future()
+        seen = []
+        future.add_done_callback(seen.append)
+        future.set_result(None)
+        future.add_done_callback(seen.append)
+        self.assertEqual(seen, [future, future])
+
+
+class TestQueueWorker(ExecutorTestCase):
+
+    def test_exception_propagates(self):
+        def fail():
+            raise ValueError('boom')
+        future = enqueue(self.queue, fail)
+        self.assertRaises(ValueError, future.result, 5)
+        self.assertIsInstance(future.exception(), ValueError)
+
+    def test_system_exit_keeps_worker_alive(self):
+        def leave():
+            raise SystemExit(2)
+        futures = [enqueue(self.queue, leave) for _ in self.workers]
+        for future in futures:
+            self.assertRaises(SystemExit, future.result, 5)
+        self.assertTrue(all(worker.is_alive() for worker in self.workers))
+        self.assertEqual(enqueue(self.queue, lambda: 'alive').result(5), 'alive')
+
+    def test_keyboard_interrupt_resolves_future(self):
+        def interrupt():
+            raise KeyboardInterrupt()
+        self.assertRaises(KeyboardInterrupt, enqueue(self.queue, interrupt).result, 5)
+        join(self.queue)
+
+    def test_cancelled_item_is_skipped(self):
+        gate = threading.Event()
+        blockers = [enqueue(self.queue, gate.wait, 5) for _ in self.workers]
+        ran = []
+        future = enqueue(self.queue, ran.append, 1)
+        self.assertTrue(future.cancel())
+        gate.set()
+        wait(blockers, 5)
+        join(self.queue)
+        self.assertEqual(ran, [])
+
+    def test_wait_and_as_completed(self):
+        slow = enqueue(self.queue, time.sleep, 0.2)
+        fast = enqueue(self.queue, lambda: None)
+        self.assertEqual(list(as_completed([slow, fast], 5)), [fast, slow])
+        done, not_done = wait([Future()], 0.05)
+        self.assertEqual((len(done), len(not_done)), (0, 1))
+
+
+class TestChain(ExecutorTestCase):
+
+    def test_steps_run_in_order(self):
+        future = chain(enqueue(self.queue, lambda: 1), self.queue, lambda value, add: value + add, 2)
+        self.assertEqual(future.result(5), 3)
+
+    def test_step_returning_future_is_followed(self):
+        inner = Future()
+        future = chain(enqueue(self.queue, lambda: None), self.queue, lambda _: inner)
+        self.assertRaises(TimeoutError, future.result, 0.1)
+        inner.set_result('inner')
+        self.assertEqual(future.result(5), 'inner')
+
+    def test_exception_skips_next_steps(self):
+        ran = []
+
+        def fail():
+            raise ValueError('first')
+        future = chain(enqueue(self.queue, fail), self.queue, lambda _: ran.append(1))
+        self.assertRaises(ValueError, future.result, 5)
+        self.assertEqual(ran, [])
+
+    def test_exception_in_step(self):
+        def fail(_):
+            raise KeyError('step')
+        self.assertRaises(KeyError, chain(enqueue(self.queue, lambda: None), self.queue, fail).result, 5)
+
+    def test_cancel_skips_next_steps(self):
+        source = Future()
+        ran = []
+        future = chain(source, self.queue, lambda _: ran.append(1))
+        self.assertTrue(future.cancel())
+        source.set_result(None)
+        join(self.queue)
+        self.assertEqual(ran, [])
+
+    def test_cancel_reaches_inner_future(self):
+        inner = Future()
+        future = chain(enqueue(self.queue, lambda: None), self.queue, lambda _: inner)
+        while inner._callbacks == []:
+            time.sleep(0.01)
+        future.cancel()
+        self.assertTrue(inner.cancelled())
+
+
+class TestWindow(unittest.TestCase):
+
+    def test_limit(self):
+        window = Window(2)
+        operations = []
+
+        def start():
+            operations.append(Future())
+            return operations[-1]
+        futures = [window.submit(start) for _ in xrange(5)]
+        self.assertEqual((len(operations), window.running), (2, 2))
+        operations[0].set_result(0)
+        self.assertEqual(len(operations), 3)
+        self.assertEqual(futures[0].result(0), 0)
+        for i in xrange(1, 5):
+            operations[i].set_result(i)
+        self.assertEqual([f.result(0) for f in futures], range(5))
+        self.assertEqual(window.running, 0)
+
+    def test_resize(self):
+        window = Window(1)
+        operations = []
+
+        def start():
+            operations.append(Future())
+            return operations[-1]
+        for _ in xrange(4):
+            window.submit(start)
+        window.resize(3)
+        self.assertEqual(len(operations), 3)
+        window.resize(1)
+        operations[0].set_result(None)
+        operations[1].set_result(None)
+        self.assertEqual((len(operations), window.running), (3, 1))
+        operations[2].set_result(None)
+        self.assertEqual(len(operations), 4)
+
+    def test_cancelled_waiting_operation_never_starts(self):
+        window = Window(1)
+        first = Future()
+        started = []
+        window.submit(lambda: first)
+        waiting = window.submit(lambda: started.append(1) or Future())
+        waiting.cancel()
+        first.set_result(None)
+        self.assertEqual(started, [])
+        self.assertEqual(window.running, 0)
+
+    def test_started_operation_cannot_be_cancelled(self):
+        window = Window(1)
+        operation = Future()
+        future = window.submit(lambda: operation)
+        self.assertFalse(future.cancel())
+        operation.set_result('done')
+        self.assertEqual(future.result(0), 'done')
+
+    def test_failing_start(self):
+        window = Window(1)
+
+        def fail():
+            raise ValueError('start')
+        self.assertRaises(ValueError, window.submit(fail).result, 0)
+        self.assertEqual(window.submit(lambda: Future()).done(), False)
+        self.assertEqual(window.running, 1)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_stop_runs_queued_calls(self):
+        pool = WorkerPool(2).start()
+        futures = [pool.submit(time.sleep, 0.05) for _ in xrange(4)]
+        pool.stop(5)
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertFalse(any(worker.is_alive() for worker in pool.workers))
+
+
+class TestCancelScope(ExecutorTestCase):
+
+    def test_keyboard_interrupt_cancels_pending(self):
+        gate = threading.Event()
+        with CancelScope() as scope:
+            blockers = [enqueue(self.queue, gate.wait, 5) for _ in self.workers]
+            pending = enqueue(self.queue, lambda: None)
+            while not all(f.running() for f in blockers):
+                time.sleep(0.01)
+            raise KeyboardInterrupt()
+        self.assertTrue(scope.cancelled)
+        self.assertTrue(pending.cancelled())
+        self.assertFalse(any(f.cancelled() for f in blockers))
+        gate.set()
+        self.assertIsNone(CancelScope.current())
+
+    def test_other_exceptions_propagate(self):
+        def run():
+            with CancelScope():
+                raise ValueError('not swallowed')
+        self.assertRaises(ValueError, run)
+
+    def test_futures_added_after_cancel_are_cancelled(self):
+        scope = CancelScope()
+        scope.cancel()
+        self.assertTrue(scope.add(Future()).cancelled())
+
+    def test_newest_first_keeps_window_from_starting(self):
+        window = Window(1)
+        first = Future()
+        started = []
+        scope = CancelScope()
+        scope.add(window.submit(lambda: first))
+        scope.add(window.submit(lambda: started.append(1) or Future()))
+        scope.cancel()
+        self.assertEqual(started, [])
+        self.assertFalse(first.cancelled())
+        self.assertEqual(window.running, 1)
+
+    def test_started_operation_joins_scope(self):
+        window = Window(1)
+        operation = Future()
+        with CancelScope() as scope:
+            future = window.submit(lambda: operation)
+        self.assertTrue(future.running())
+        self.assertFalse(future.cancel())
+        scope.cancel()
+        self.assertTrue(operation.cancelled())
+        self.assertTrue(future.cancelled())
+        self.assertEqual(window.running, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
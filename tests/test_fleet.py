@@ -0,0 +1,94 @@
+import unittest
+
+from pyArubaConsole.helper.Fleet import member_names, owns, parse_spec, plan
+
+
+def smart(name='web', count=2, dc='1', **fields):
+    group = {'dc': dc, 'name': name, 'count': count, 'type': 'smart', 'package': 'small', 'template': '10',
+             'admin_pwd': 'secret'}
+    group.update(fields)
+    return group
+
+
+def row(name, sid, **fields):
+    vm = {'name': name, 'sid': sid, 'type': 'smart', 'package': 'small', 'template': '10'}
+    vm.update(fields)
+    return vm
+
+
+class TestParseSpec(unittest.TestCase):
+
+    def test_defaults_apply_to_groups(self):
+        groups = parse_spec({'dc': 2, 'template': 10, 'admin_pwd': 'secret',
+                             'groups': [{'name': 'web', 'count': '3', 'type': 'smart', 'package': 'small'},
+                                        {'name': 'db', 'count': 1, 'type': 'pro', 'dc': 3}]})
+        self.assertEqual([(g['dc'], g['name'], g['count'], g['template']) for g in groups],
+                         [('2', 'web', 3, '10'), ('3', 'db', 1, '10')])
+        self.assertEqual((groups[1]['cpu'], groups[1]['ram'], groups[1]['disks'], groups[1]['buyip']),
+                         (1, 1, [10], False))
+
+    def test_list_of_groups(self):
+        self.assertEqual(len(parse_spec([smart(), smart('api')])), 2)
+
+    def test_invalid_specs(self):
+        for spec in ({'groups': 'web'},
+                     [smart(count=-1)],
+                     [smart(name='web_1')],
+                     [smart(type='tiny')],
+                     [dict((k, v) for k, v in smart().items() if k != 'package')],
+                     [dict((k, v) for k, v in smart().items() if k != 'template')],
+                     [smart(type='pro', disks=[])],
+                     [smart(), smart()],
+                     ['web']):
+            self.assertRaises(ValueError, parse_spec, spec)
+
+    def test_same_name_in_other_dc(self):
+        self.assertEqual(len(parse_spec([smart(), smart(dc='2')])), 2)
+
+
+class TestOwnership(unittest.TestCase):
+
+    def test_member_names(self):
+        self.assertEqual(member_names(smart(count=3)), ['web-01', 'web-02', 'web-03'])
+        self.assertEqual(member_names(smart(count=0)), [])
+
+    def test_owns_member_names_only(self):
+        group = smart(count=2)
+        for name in ('web-01', 'web-02', 'web-07', 'web-100'):
+            self.assertTrue(owns(group, name), name)
+        for name in ('web-1', 'web-001', 'web-00', 'web-', 'web-01a', 'web-01-02', 'webx-01', 'api-01', 'web'):
+            self.assertFalse(owns(group, name), name)
+
+
+class TestPlan(unittest.TestCase):
+
+    def test_creates_missing_members(self):
+        creates, deletes, drifts = plan([smart(count=3)], lambda dc: [row('web-02', 1)])
+        self.assertEqual([name for _, name in creates], ['web-01', 'web-03'])
+        self.assertEqual((deletes, drifts), ([], []))
+
+    def test_deletes_members_beyond_count_and_duplicates(self):
+        rows = [row('web-01', 1), row('web-01', 2), row('web-02', 3), row('web-03', 4)]
+        creates, deletes, _ = plan([smart(count=2)], lambda dc: rows)
+        self.assertEqual(creates, [])
+        self.assertEqual([vm['sid'] for _, vm in deletes], [2, 4])
+
+    def test_leaves_vms_it_does_not_own(self):
+        rows = [row('web-1', 1), row('web-001', 2), row('web-01-02', 3), row('other', 4), row('web-01', 5)]
+        creates, deletes, _ = plan([smart(count=1)], lambda dc: rows)
+        self.assertEqual((creates, deletes), ([], []))
+
+    def test_reports_drift(self):
+        rows = [row('web-01', 1, package='large'), row('web-02', 2, template=None)]
+        _, _, drifts = plan([smart(count=2)], lambda dc: rows)
+        self.assertEqual([(vm['name'], fields) for _, vm, fields in drifts],
+                         [('web-01', {'package': ('large', 'small')})])
+
+    def test_rows_per_dc(self):
+        rows = {'1': [row('web-01', 1)], '2': []}
+        creates, _, _ = plan([smart(count=1), smart(count=1, dc='2')], lambda dc: rows[dc])
+        self.assertEqual([(group['dc'], name) for group, name in creates], [('2', 'web-01')])
+
+
+if __name__ == '__main__':
+    unittest.main()
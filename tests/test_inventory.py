@@ -0,0 +1,148 @@
+import threading
+import time
+import unittest
+
+from pyArubaConsole.helper.Inventory import Inventory, vm_ips
+
+
+class Vm(object):
+
+    def __init__(self, sid, vm_name, ip_addr=None):
+        self.sid = sid
+        self.vm_name = vm_name
+        self.ip_addr = ip_addr
+
+
+class Ip(object):
+
+    def __init__(self, ip_addr):
+        self.ip_addr = ip_addr
+
+
+def names(vms):
+    return sorted(vm.vm_name for vm in vms)
+
+
+class TestVmIps(unittest.TestCase):
+
+    def test_shapes(self):
+        self.assertEqual(vm_ips(Vm(1, 'a')), [])
+        self.assertEqual(vm_ips(Vm(1, 'a', '10.0.0.1')), ['10.0.0.1'])
+        self.assertEqual(vm_ips(Vm(1, 'a', [Ip('10.0.0.1'), Ip(''), '10.0.0.2'])), ['10.0.0.1', '10.0.0.2'])
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.inventory = Inventory(lambda dc: [])
+        self.inventory.update('1', [Vm(1, 'web-01', '10.0.0.1'), Vm(2, 'web-02', '10.0.0.2'), Vm(3, 'db')])
+        self.inventory.update('2', [Vm(1, 'web-01', '10.0.1.1')])
+
+    def test_lookups(self):
+        self.assertEqual(len(self.inventory.by_name('web-01')), 2)
+        self.assertEqual(names(self.inventory.by_name('web-01', ['2'])), ['web-01'])
+        self.assertEqual(names(self.inventory.by_prefix('web')), ['web-01', 'web-01', 'web-02'])
+        self.assertEqual(names(self.inventory.by_sid(3)), ['db'])
+        self.assertEqual(names(self.inventory.by_ip('10.0.0.2')), ['web-02'])
+        self.assertEqual(names(self.inventory.find('eb-0', ['1'])), ['web-01', 'web-02'])
+
+    def test_update_reindexes_renamed_vm(self):
+        self.inventory.update('1', [Vm(1, 'api-01', '10.0.0.9'), Vm(2, 'web-02', '10.0.0.2'), Vm(3, 'db')])
+        self.assertEqual(names(self.inventory.by_name('api-01')), ['api-01'])
+        self.assertEqual(names(self.inventory.by_name('web-01')), ['web-01'])
+        self.assertEqual(self.inventory.by_ip('10.0.0.1'), [])
+        self.assertEqual(names(self.inventory.by_ip('10.0.0.9')), ['api-01'])
+        self.assertEqual(names(self.inventory.by_prefix('web', ['1'])), ['web-02'])
+
+    def test_update_removes_missing_vms(self):
+        self.inventory.update('1', [Vm(3, 'db')])
+        self.assertEqual(self.inventory.by_name('web-02'), [])
+        self.assertEqual(self.inventory.by_ip('10.0.0.2'), [])
+        self.assertEqual(self.inventory._names, ['db', 'web-01'])
+
+    def test_update_keeps_unchanged_vm_objects_fresh(self):
+        vm = Vm(3, 'db')
+        self.inventory.update('1', [vm])
+        self.assertIs(self.inventory.by_sid(3)[0], vm)
+
+    def test_drop(self):
+        self.inventory.drop('1')
+        self.assertFalse(self.inventory.loaded('1'))
+        self.assertEqual(self.inventory.by_name('db'), [])
+        self.assertEqual(self.inventory.by_ip('10.0.0.1'), [])
+        self.assertEqual(names(self.inventory.by_prefix('')), ['web-01'])
+        self.assertEqual(self.inventory.vms('1'), [])
+
+
+class TestRefresh(unittest.TestCase):
+
+    def test_stale_after_ttl(self):
+        inventory = Inventory(lambda dc: [], ttl=0.05)
+        self.assertTrue(inventory.stale('1'))
+        inventory.refresh('1')
+        self.assertFalse(inventory.stale('1'))
+        time.sleep(0.06)
+        self.assertTrue(inventory.stale('1'))
+        inventory.invalidate('1')
+        self.assertFalse(inventory.loaded('1'))
+
+    def test_refreshes_of_one_dc_are_serialized(self):
+        lock = threading.Lock()
+        running = []
+        overlaps = []
+
+        def fetch(dc):
+            with lock:
+                running.append(dc)
+                overlaps.append(running.count(dc))
+            time.sleep(0.02)
+            with lock:
+                running.remove(dc)
+            return [Vm(1, 'web-01')]
+        spawned = []
+
+        def spawn(function, dc):
+            spawned.append(Inventory._thread(function, dc))
+        inventory = Inventory(fetch, spawn=spawn)
+        threads = [threading.Thread(target=inventory.refresh, args=('1',)) for _ in xrange(3)]
+        for t in threads:
+            t.start()
+        inventory.refresh_in_background('1')
+        for t in threads + spawned:
+            t.join(5)
+        self.assertEqual(len(overlaps), 4)
+        self.assertEqual(max(overlaps), 1)
+        self.assertEqual(names(inventory.vms('1')), ['web-01'])
+
+    def test_dcs_refresh_concurrently(self):
+        other = threading.Event()
+        seen = []
+
+        def fetch(dc):
+            if dc == '1':
+                seen.append(other.wait(5))
+            else:
+                other.set()
+            return []
+        inventory = Inventory(fetch)
+        t = threading.Thread(target=inventory.refresh, args=('1',))
+        t.start()
+        inventory.refresh('2')
+        t.join(5)
+        self.assertEqual(seen, [True])
+        self.assertTrue(inventory.loaded('1'))
+
+    def test_background_refresh_runs_once(self):
+        spawned = []
+        inventory = Inventory(lambda dc: [], spawn=lambda function, dc: spawned.append((function, dc)))
+        inventory.refresh_in_background('1')
+        inventory.refresh_in_background('1')
+        self.assertEqual(len(spawned), 1)
+        function, dc = spawned[0]
+        function(dc)
+        inventory.refresh_in_background('1')
+        self.assertEqual(len(spawned), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+
+from pyArubaConsole.helper.JobTracker import JobTracker
+
+
+def job(job_id, vm_name):
+    return {'JobId': job_id, 'ServerName': vm_name}
+
+
+class Jobs(object):
+    """get_jobs() returning the scripted job lists in turn, the last one forever."""
+
+    def __init__(self, *lists):
+        self.lists = list(lists)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if len(self.lists) > 1:
+            return self.lists.pop(0)
+        return self.lists[0]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestWait(unittest.TestCase):
+
+    def test_wait_for_vm_and_job(self):
+        tracker = JobTracker(Jobs([job(1, 'web'), job(2, 'db')], [job(2, 'db')], []), min_interval=0.01)
+        self.assertTrue(tracker.wait('web', 5))
+        self.assertTrue(tracker.wait(2, 5))
+        self.assertTrue(tracker.wait(job(1, 'web'), 5))
+
+    def test_wait_for_every_job(self):
+        jobs = Jobs([job(1, 'web')], [job(1, 'web')], [])
+        tracker = JobTracker(jobs, min_interval=0.01)
+        self.assertTrue(tracker.wait(None, 5))
+        self.assertEqual(jobs.calls, 3)
+
+    def test_waiter_needs_a_tick_after_registering(self):
+        jobs = Jobs([])
+        tracker = JobTracker(jobs, min_interval=0.01)
+        self.assertTrue(tracker.wait('web', 5))
+        polls = tracker.polls
+        self.assertTrue(tracker.wait('web', 5))
+        self.assertGreater(tracker.polls, polls)
+
+    def test_failing_poll_is_not_a_tick(self):
+        calls = []
+
+        def get_jobs():
+            calls.append(1)
+            if len(calls) == 1:
+                raise IOError('down')
+            return []
+        tracker = JobTracker(get_jobs, min_interval=0.01)
+        self.assertTrue(tracker.wait('web', 5))
+        self.assertEqual(len(calls), 2)
+
+    def test_wait_timeout(self):
+        tracker = JobTracker(Jobs([job(1, 'web')]), min_interval=0.01)
+        self.assertFalse(tracker.wait('web', 0.1))
+
+    def test_interval_backs_off(self):
+        jobs = Jobs([job(1, 'web')])
+        tracker = JobTracker(jobs, min_interval=0.05, max_interval=0.1, backoff=2)
+        tracker.wait('web', 0.5)
+        self.assertLessEqual(jobs.calls, 7)
+
+
+class TestWatch(unittest.TestCase):
+
+    def test_watch_resolves_true(self):
+        tracker = JobTracker(Jobs([job(1, 'web')], []), min_interval=0.01)
+        self.assertTrue(tracker.watch('web').result(5))
+
+    def test_watch_timeout(self):
+        tracker = JobTracker(Jobs([job(1, 'web')]), min_interval=0.01)
+        self.assertFalse(tracker.watch('web', 0.1).result(5))
+
+    def test_callback_may_watch_again(self):
+        tracker = JobTracker(Jobs([]), min_interval=0.01)
+        second = []
+        tracker.watch('web').add_done_callback(lambda f: second.append(tracker.watch('db')))
+        self.assertTrue(wait_for(lambda: len(second) == 1))
+        self.assertTrue(second[0].result(5))
+
+
+class TestPoller(unittest.TestCase):
+
+    def test_thread_exits_when_nobody_waits(self):
+        jobs = Jobs([])
+        tracker = JobTracker(jobs, min_interval=0.01)
+        tracker.wait('web', 5)
+        self.assertTrue(wait_for(lambda: tracker._thread is None))
+        calls = jobs.calls
+        time.sleep(0.05)
+        self.assertEqual(jobs.calls, calls)
+
+    def test_thread_exits_when_watches_are_cancelled(self):
+        tracker = JobTracker(Jobs([job(1, 'web')]), min_interval=0.01)
+        tracker.watch('web').cancel()
+        self.assertTrue(wait_for(lambda: tracker._thread is None))
+
+    def test_waiters_share_one_thread(self):
+        jobs = Jobs([job(1, 'web')], [job(1, 'web')], [])
+        tracker = JobTracker(jobs, min_interval=0.01)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(tracker.wait('web', 5))) for _ in xrange(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(results, [True] * 5)
+        self.assertLess(jobs.calls, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import time
+import unittest
+
+from pyArubaConsole.helper.Resilience import CircuitBreaker, backoff, call_with_retries
+
+
+class Flaky(object):
+    """Callable raising the given exceptions in turn, then returning 'ok'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.__name__ = 'flaky'
+
+    def __call__(self):
+        self.calls += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertGreater(breaker.retry_in(), 0)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(threshold=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.failure()
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(breaker.retry_in(), 0)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_failed_trial_keeps_circuit_open(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+class TestRetries(unittest.TestCase):
+
+    def test_backoff_range(self):
+        for attempt in xrange(10):
+            self.assertTrue(0 <= backoff(attempt, base=0.5, cap=2) <= min(2, 0.5 * 2 ** attempt))
+
+    def test_transient_errors_are_retried(self):
+        function = Flaky(IOError('1'), IOError('2'))
+        self.assertEqual(call_with_retries(function, retries=2, base=0.001), 'ok')
+        self.assertEqual(function.calls, 3)
+
+    def test_retries_exhausted(self):
+        function = Flaky(IOError('1'), IOError('2'), IOError('3'))
+        self.assertRaises(IOError, call_with_retries, function, retries=2, base=0.001)
+        self.assertEqual(function.calls, 3)
+
+    def test_other_errors_are_not_retried(self):
+        function = Flaky(ValueError('bad'))
+        self.assertRaises(ValueError, call_with_retries, function, retries=2, base=0.001)
+        self.assertEqual(function.calls, 1)
+
+    def test_no_retry_past_deadline(self):
+        function = Flaky(IOError('1'))
+        started = time.time()
+        self.assertRaises(IOError, call_with_retries, function, retries=5, deadline=time.time(), base=10, cap=10)
+        self.assertEqual(function.calls, 1)
+        self.assertLess(time.time() - started, 1)
+
+    def test_retry_within_deadline(self):
+        function = Flaky(IOError('1'))
+        self.assertEqual(call_with_retries(function, deadline=time.time() + 5, base=0.001), 'ok')
+        self.assertEqual(function.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
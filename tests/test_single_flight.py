@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+
+from pyArubaConsole.helper.SingleFlight import SingleFlight
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def concurrent_calls(self, flight, count, gate, *args):
+        """Start count calls while the first one is held at gate, return their outcomes."""
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(flight(*args))
+            except Exception as e:
+                outcomes.append(e)
+        threads = [threading.Thread(target=call) for _ in xrange(count)]
+        for t in threads:
+            t.start()
+        self.assertTrue(wait_for(lambda: flight.shared == count - 1))
+        gate.set()
+        for t in threads:
+            t.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_result(self):
+        gate = threading.Event()
+        results = []
+
+        def function(x):
+            gate.wait(5)
+            results.append(object())
+            return results[-1]
+        flight = SingleFlight(function)
+        outcomes = self.concurrent_calls(flight, 4, gate, 1)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(outcomes, results * 4)
+        self.assertEqual(flight.stats(), {'calls': 1, 'shared': 3, 'cached': 0})
+
+    def test_concurrent_calls_share_exception(self):
+        gate = threading.Event()
+
+        def function():
+            gate.wait(5)
+            raise KeyError('boom')
+        flight = SingleFlight(function)
+        outcomes = self.concurrent_calls(flight, 3, gate)
+        self.assertEqual(len(outcomes), 3)
+        self.assertTrue(all(isinstance(e, KeyError) for e in outcomes))
+        self.assertEqual(flight.calls, 1)
+
+    def test_exception_is_not_cached(self):
+        calls = []
+
+        def function():
+            calls.append(1)
+            if len(calls) == 1:
+                raise IOError('first')
+            return 'second'
+        flight = SingleFlight(function, ttl=60)
+        self.assertRaises(IOError, flight)
+        self.assertEqual(flight(), 'second')
+
+    def test_different_arguments_do_not_share(self):
+        flight = SingleFlight(lambda x, y=0: x + y)
+        self.assertEqual((flight(1), flight(1, y=2), flight(2)), (1, 3, 2))
+        self.assertEqual(flight.calls, 3)
+
+    def test_ttl(self):
+        calls = []
+        flight = SingleFlight(lambda: calls.append(1) or len(calls), ttl=0.05)
+        self.assertEqual((flight(), flight()), (1, 1))
+        self.assertEqual(flight.cached, 1)
+        time.sleep(0.06)
+        self.assertEqual(flight(), 2)
+        flight.invalidate()
+        self.assertEqual(flight(), 3)
+
+    def test_no_ttl_calls_again(self):
+        calls = []
+        flight = SingleFlight(lambda: calls.append(1))
+        flight()
+        flight()
+        self.assertEqual((len(calls), flight.cached), (2, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()